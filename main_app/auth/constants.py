@@ -1,3 +1,9 @@
 USERS_CACHE_KEY_PREFIX = "users"
-USERS_CACHE_KEY_TEMPLATE = f"{USERS_CACHE_KEY_PREFIX}:sort_by_{{}}:order_{{}}:limit_{{}}:offset_{{}}"
+# the version is incremented to invalidate all cached lists at once, the lists of old versions expire by TTL
+USERS_CACHE_VERSION_KEY = f"{USERS_CACHE_KEY_PREFIX}:version"
+USERS_CACHE_KEY_TEMPLATE = f"{USERS_CACHE_KEY_PREFIX}:v{{}}:sort_by_{{}}:order_{{}}:limit_{{}}:page_{{}}"
 USERS_CACHE_TTL = 1800
+
+USER_PROFILE_CACHE_KEY_TEMPLATE = "user_profile:id_{id}"
+# the current user is resolved from this cache, so the TTL is short
+USER_PROFILE_CACHE_TTL = 300
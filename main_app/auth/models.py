@@ -1,4 +1,5 @@
 from fastapi_users_db_sqlalchemy import SQLAlchemyBaseUserTable
+from sqlalchemy import Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 from main_app.database import BaseDbModel, IntPk, String100
@@ -6,6 +7,11 @@ from main_app.database import BaseDbModel, IntPk, String100
 
 class User(SQLAlchemyBaseUserTable[int], BaseDbModel):
     __tablename__ = "user"
+    __table_args__ = (
+        # the users list is sorted only by indexed columns with the primary key as a tie-breaker
+        Index("ix_user_first_name_id", "first_name", "id"),
+        Index("ix_user_last_name_id", "last_name", "id"),
+    )
 
     id: Mapped[IntPk]
     first_name: Mapped[String100]
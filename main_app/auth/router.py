@@ -1,7 +1,7 @@
 import traceback
 
 from aioredis.exceptions import ConnectionError as RedisConnectionError
-from fastapi import Depends, HTTPException, Request
+from fastapi import Depends, HTTPException, Request, Response, Query
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
@@ -15,9 +15,9 @@ from main_app.auth.schemas import UserRead, UserUpdate, UserCreate
 from main_app.auth.services.user_service import UserService
 from main_app.dependencies import get_async_session
 from main_app.config import settings, logger
-from main_app.exceptions import ColumnDoesNotExistError
+from main_app.exceptions import ColumnDoesNotExistError, ColumnIsNotSortableError, InvalidCursorError
 from main_app.filters import SimpleSorting
-from main_app.pagination import DefaultPagination
+from main_app.pagination import DefaultPagination, KeysetPagination
 
 
 auth_router = auth_service.get_auth_router(auth_backend)
@@ -40,36 +40,79 @@ users_router = auth_service.get_users_router(UserRead, UserUpdate)
 
 @users_router.get("/", response_model=list[UserRead])
 async def get_users_list(
+        response: Response,
         pagination: DefaultPagination = Depends(),
         sorting: SimpleSorting = Depends(),
+        cursor: str | None = Query(None, description="Value of the 'X-Next-Cursor' header of the previous page"),
         session: AsyncSession = Depends(get_async_session),
         current_user: User = Depends(current_active_user)
 ):
+    """
+    Offset pagination is kept for compatibility. If the offset is not specified, the keyset (cursor) pagination
+    is used, and the cursor of the next page is returned in the 'X-Next-Cursor' header.
+    """
+
     logger.info(f"'get_users_list' has called by user with id {current_user.id}")
 
+    if cursor is not None and pagination.offset:
+        raise HTTPException(status_code=400, detail={
+            "status": "error",
+            "details": "Offset can not be combined with the cursor pagination."
+        })
+
+    page_pagination = pagination
+    if not pagination.offset:
+        try:
+            if cursor is not None:
+                page_pagination = KeysetPagination.from_cursor(cursor, pagination.limit)
+
+                # the value of the sort column is not needed only when the users are sorted by the primary key
+                is_incomplete = (
+                    not page_pagination.is_first_page
+                    and sorting.sort_by != "id"
+                    and page_pagination.after_value is None
+                )
+                if is_incomplete or not page_pagination.is_issued_for(sorting.sort_by, sorting.order):
+                    raise InvalidCursorError(cursor)
+            else:
+                page_pagination = KeysetPagination(
+                    limit=pagination.limit,
+                    sort_by=sorting.sort_by,
+                    order=sorting.order
+                )
+
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail={
+                "status": "error",
+                "details": str(e)
+            })
+
     try:
-        users = await UserService.get_from_cache(sorting, pagination)
+        cache_version = await UserService.get_cache_version()
+        users = await UserService.get_from_cache(sorting, page_pagination, cache_version)
     except RedisConnectionError:
+        cache_version = None
         users = None
         logger.warning("Connection to redis failed while getting a cache!")
 
     if not users:
         try:
-            users = await UserService.get(session, sorting, pagination)
+            with UserService.reading_from_primary(session, enabled=cache_version is not None):
+                users = await UserService.get(session, sorting, page_pagination)
 
-            if users:
-                await UserService.save_to_cache(users, sorting, pagination)
+            if users and cache_version is not None:
+                await UserService.save_to_cache(users, sorting, page_pagination, cache_version)
 
         except RedisConnectionError:
             logger.warning("Connection to redis failed while saving a cache!")
 
-        except ColumnDoesNotExistError as e:
+        except (ColumnDoesNotExistError, ColumnIsNotSortableError) as e:
             traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
             logger.error(f"{e} More details:\n{traceback_message}")
 
             raise HTTPException(status_code=400, detail={
                 "status": "error",
-                "details": e
+                "details": str(e)
             })
 
         except SQLAlchemyError as e:
@@ -90,6 +133,13 @@ async def get_users_list(
                 "details": f"An unexpected server error has occurred: {e}"
             })
 
+    if isinstance(page_pagination, KeysetPagination) and len(users) == page_pagination.limit:
+        last_user = UserRead.model_validate(users[-1])
+        response.headers["X-Next-Cursor"] = page_pagination.get_next_cursor(
+            getattr(last_user, sorting.sort_by),
+            last_user.id
+        )
+
     return users
 
 
@@ -101,6 +151,9 @@ async def link_telegram_id(email: str, telegram_id: int, session: AsyncSession =
             user.telegram_id = telegram_id
             await session.commit()
 
+            await UserService.invalidate_profile(user.id)
+            await UserService.invalidate_cache()
+
         except IntegrityError:
             await session.rollback()
 
@@ -109,6 +162,11 @@ async def link_telegram_id(email: str, telegram_id: int, session: AsyncSession =
                 "details": "The specified telegram account is already being used by another user"
             })
 
+        except RedisConnectionError as e:
+            traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+            logger.error(f"Error while updating cache after linking a telegram account. "
+                         f"More details:\n{traceback_message}")
+
         except SQLAlchemyError as e:
             traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
             logger.error(f"Details:\n{traceback_message}")
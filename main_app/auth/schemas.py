@@ -1,5 +1,5 @@
 from fastapi_users import schemas
-from pydantic import ConfigDict
+from pydantic import ConfigDict, TypeAdapter
 
 
 class UserRead(schemas.BaseUser[int]):
@@ -11,6 +11,13 @@ class UserRead(schemas.BaseUser[int]):
 
     model_config = ConfigDict(from_attributes=True)
 
+    @property
+    def full_name(self) -> str:
+        return f"{self.first_name} {self.last_name}"
+
+
+UserReadList = TypeAdapter(list[UserRead])
+
 
 class UserCreate(schemas.BaseUserCreate):
     first_name: str
@@ -1,17 +1,18 @@
 import traceback
+from typing import Any
 
 from aioredis.exceptions import ConnectionError as RedisConnectionError
-from fastapi import Depends, Request
+from fastapi import Depends, Request, WebSocket
 from fastapi_users import BaseUserManager, IntegerIDMixin, FastAPIUsers
 from fastapi_users.authentication import JWTStrategy, CookieTransport, AuthenticationBackend
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from main_app.auth.constants import USERS_CACHE_KEY_PREFIX
 from main_app.auth.models import User
+from main_app.auth.services.user_service import UserService
+from main_app.database import async_sessionmaker_instance, replica_set
 from main_app.dependencies import get_async_session
 from main_app.config import settings, logger
-from main_app.database import redis_client
 
 
 class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
@@ -21,26 +22,108 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
     # удаление списка пользователей из кеша при регистрации нового пользователя
     async def on_after_register(self, user: User, request: Request | None = None):
         try:
-            keys_to_delete = await redis_client.keys(f"{USERS_CACHE_KEY_PREFIX}:*")
-            if keys_to_delete:
-                await redis_client.delete(*keys_to_delete)
-                logger.info("Users cache has successfully cleared!")
+            await UserService.invalidate_cache()
+            logger.info("Users cache has successfully cleared!")
 
         except RedisConnectionError as e:
             traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
             logger.error(f"Error while updating cache after registration. More details:\n{traceback_message}")
 
+    async def on_after_update(self, user: User, update_dict: dict[str, Any], request: Request | None = None):
+        try:
+            await UserService.invalidate_profile(user.id)
+            await UserService.invalidate_cache()
+
+        except RedisConnectionError as e:
+            traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+            logger.error(f"Error while updating cache after updating a user. More details:\n{traceback_message}")
+
+    async def on_after_delete(self, user: User, request: Request | None = None):
+        try:
+            await UserService.invalidate_profile(user.id)
+            await UserService.invalidate_cache()
+
+        except RedisConnectionError as e:
+            traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+            logger.error(f"Error while updating cache after deleting a user. More details:\n{traceback_message}")
+
+
+class CachedUserDatabase(SQLAlchemyUserDatabase):
+    """
+    Reads users by ID from the profiles cache, so resolving the current user doesn't access the database on
+    a cache hit. The returned instances are not bound to the session, so they must not be modified.
+    """
+
+    async def get(self, id: int) -> User | None:
+        # the session now works on behalf of the user: their writes pin them to the primary, and their reads
+        # go to the primary while they are pinned
+        self.session.info["user_id"] = id
+        if self.session.info.get("use_replica") and replica_set.is_enabled:
+            try:
+                if await replica_set.is_pinned_to_primary(id):
+                    self.session.info["use_replica"] = False
+
+            except RedisConnectionError as e:
+                logger.warning(f"Failed to check whether user with ID {id} is pinned to the primary database: {e}")
+                self.session.info["use_replica"] = False
+
+        profile = await UserService.get_profile(self.session, id)
+        if profile is None:
+            return None
+
+        return User(**profile.model_dump())
+
+
+class CachedUserJWTStrategy(JWTStrategy):
+    async def destroy_token(self, token: str, user: User) -> None:
+        # a JWT can't be revoked, but the cached user is dropped on logout
+        try:
+            await UserService.invalidate_profile(user.id)
+
+        except RedisConnectionError as e:
+            traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+            logger.error(f"Error while updating cache after logout. More details:\n{traceback_message}")
+
 
 async def get_user_db(session: AsyncSession = Depends(get_async_session)):
     yield SQLAlchemyUserDatabase(session, User)
 
 
+async def get_cached_user_db(session: AsyncSession = Depends(get_async_session)):
+    yield CachedUserDatabase(session, User)
+
+
 async def get_user_manager(user_db=Depends(get_user_db)):
     yield UserManager(user_db)
 
 
+async def get_cached_user_manager(user_db=Depends(get_cached_user_db)):
+    yield UserManager(user_db)
+
+
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(secret=settings.SECRET_KEY_FOR_JWT, lifetime_seconds=None)
+    return CachedUserJWTStrategy(secret=settings.SECRET_KEY_FOR_JWT, lifetime_seconds=None)
+
+
+async def get_websocket_user(websocket: WebSocket) -> User | None:
+    """
+    The dependencies of "cached_auth_service" read the token from the request, so they can't be used by websocket
+    routes, and the user of a websocket is resolved from the same cookie here.
+
+    :return: The active user or None if the token is missing or invalid.
+    """
+
+    token = websocket.cookies.get(cookie_transport.cookie_name)
+    if token is None:
+        return None
+
+    async with async_sessionmaker_instance() as session:
+        user = await get_jwt_strategy().read_token(token, UserManager(CachedUserDatabase(session, User)))
+
+    if user is None or not user.is_active:
+        return None
+
+    return user
 
 
 cookie_transport = CookieTransport(cookie_name="auth")
@@ -54,3 +137,9 @@ auth_service = FastAPIUsers[User, int](
     get_user_manager,
     [auth_backend],
 )
+
+# only for resolving the current user in dependencies, the routers of "auth_service" modify users
+cached_auth_service = FastAPIUsers[User, int](
+    get_cached_user_manager,
+    [auth_backend],
+)
@@ -1,16 +1,27 @@
-import json
+import traceback
 from datetime import datetime
 
-from sqlalchemy import select, desc, asc
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+from sqlalchemy import select, desc, asc, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
 
-from main_app.auth.constants import USERS_CACHE_KEY_TEMPLATE, USERS_CACHE_TTL
+from main_app.auth.constants import (
+    USERS_CACHE_VERSION_KEY,
+    USERS_CACHE_KEY_TEMPLATE,
+    USERS_CACHE_TTL,
+    USER_PROFILE_CACHE_KEY_TEMPLATE,
+    USER_PROFILE_CACHE_TTL
+)
 from main_app.auth.models import User
-from main_app.auth.schemas import UserCreate, UserUpdate, UserRead
+from main_app.auth.schemas import UserCreate, UserUpdate, UserRead, UserReadList
+from main_app import serialization
+from main_app.config import logger
 from main_app.database import redis_client
-from main_app.exceptions import ColumnDoesNotExistError
+from main_app.local_cache import local_cache
+from main_app.exceptions import ColumnDoesNotExistError, ColumnIsNotSortableError
 from main_app.filters import SimpleSorting
-from main_app.pagination import DefaultPagination
+from main_app.pagination import DefaultPagination, KeysetPagination
 from main_app.service import BaseDAO
 
 
@@ -20,25 +31,52 @@ class UserService(BaseDAO[User, UserCreate, UserUpdate], model=User):
             cls,
             session: AsyncSession,
             sorting: SimpleSorting | None = None,
-            pagination: DefaultPagination | None = None
+            pagination: DefaultPagination | KeysetPagination | None = None
     ) -> list[User]:
-        if not hasattr(User, sorting.sort_by):
-            raise ColumnDoesNotExistError(sorting.sort_by)
+        sorting = sorting or SimpleSorting()
+        sort_column = cls.get_sort_column(sorting.sort_by)
+        order = desc if sorting.order == "desc" else asc
 
-        query = select(User)
-        if sorting:
-            if sorting.order == "desc":
-                query = query.order_by(desc(getattr(User, sorting.sort_by)))
-            else:
-                query = query.order_by(asc(getattr(User, sorting.sort_by)))
+        query = select(User).order_by(order(sort_column))
+        if sort_column is not User.id:
+            query = query.order_by(order(User.id))
 
-        if pagination:
+        if isinstance(pagination, KeysetPagination):
+            if not pagination.is_first_page:
+                if sort_column is User.id:
+                    key, last_key = User.id, pagination.after_id
+                else:
+                    key, last_key = tuple_(sort_column, User.id), tuple_(pagination.after_value, pagination.after_id)
+
+                query = query.where(key < last_key if sorting.order == "desc" else key > last_key)
+
+            query = query.limit(pagination.limit)
+
+        elif pagination:
             query = query.limit(pagination.limit).offset(pagination.offset)
 
         all_users = await session.scalars(query)
 
         return all_users.all()
 
+    @classmethod
+    def get_sort_column(cls, column_name: str) -> InstrumentedAttribute:
+        """
+        Only the primary key and columns that are the first ones in an index are allowed, so a page is read
+        with an index scan instead of sorting the whole table.
+        """
+
+        if column_name not in User.__table__.columns:
+            raise ColumnDoesNotExistError(column_name)
+
+        sortable_columns = {column.name for column in User.__table__.primary_key.columns}
+        sortable_columns.update(next(iter(index.columns)).name for index in User.__table__.indexes)
+
+        if column_name not in sortable_columns:
+            raise ColumnIsNotSortableError(column_name)
+
+        return getattr(User, column_name)
+
     @classmethod
     async def get_one_or_none(
             cls,
@@ -51,24 +89,176 @@ class UserService(BaseDAO[User, UserCreate, UserUpdate], model=User):
         return users.first()
 
     @classmethod
-    async def get_from_cache(cls, sorting: SimpleSorting, pagination: DefaultPagination) -> list[User] | None:
-        cache_key = USERS_CACHE_KEY_TEMPLATE.format(sorting.sort_by, sorting.order, pagination.limit, pagination.offset)
+    async def get_cache_version(cls) -> int:
+        """
+        The version must be received before the users are loaded from the database and passed to "save_to_cache",
+        so a list that was loaded before an invalidation is not saved as a new one.
+        """
+
+        cache_generation = local_cache.get_generation(USERS_CACHE_VERSION_KEY)
+        cache_version = local_cache.get(USERS_CACHE_VERSION_KEY)
+
+        if cache_version is None:
+            cache_version = int(await redis_client.get(USERS_CACHE_VERSION_KEY) or 0)
+            local_cache.set(
+                USERS_CACHE_VERSION_KEY,
+                cache_version,
+                8,
+                tag=USERS_CACHE_VERSION_KEY,
+                generation=cache_generation
+            )
+
+        return cache_version
+
+    @classmethod
+    async def invalidate_cache(cls) -> None:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.incr(USERS_CACHE_VERSION_KEY)
+            await local_cache.invalidate(USERS_CACHE_VERSION_KEY, pipe)
+            await pipe.execute()
+
+    @classmethod
+    async def get_from_cache(
+            cls,
+            sorting: SimpleSorting,
+            pagination: DefaultPagination | KeysetPagination,
+            cache_version: int
+    ) -> list[User] | None:
+        cache_key = cls._get_cache_key(sorting, pagination, cache_version)
+        cache_generation = local_cache.get_generation(USERS_CACHE_VERSION_KEY)
+
+        users = local_cache.get(cache_key)
+        if users is not None:
+            return users
+
         cached_users = await redis_client.get(cache_key)
 
         if cached_users:
             await redis_client.expire(cache_key, USERS_CACHE_TTL)
 
-            return json.loads(cached_users)
+            users = serialization.loads(cached_users)
+            # lists of all versions are dropped when the version is incremented
+            local_cache.set(
+                cache_key,
+                users,
+                len(cached_users),
+                tag=USERS_CACHE_VERSION_KEY,
+                generation=cache_generation
+            )
+
+            return users
         else:
             return None
 
     @classmethod
-    async def save_to_cache(cls, users: list[User], sorting: SimpleSorting, pagination: DefaultPagination) -> None:
-        validated_users = [UserRead.model_validate(user).model_dump() for user in users]
-        cache_key = USERS_CACHE_KEY_TEMPLATE.format(sorting.sort_by, sorting.order, pagination.limit, pagination.offset)
+    async def save_to_cache(
+            cls,
+            users: list[User],
+            sorting: SimpleSorting,
+            pagination: DefaultPagination | KeysetPagination,
+            cache_version: int
+    ) -> None:
+        validated_users = [UserRead.model_validate(user) for user in users]
+        cache_key = cls._get_cache_key(sorting, pagination, cache_version)
 
         await redis_client.set(
             cache_key,
-            json.dumps(validated_users),
+            UserReadList.dump_json(validated_users),
             ex=USERS_CACHE_TTL
         )
+
+    @staticmethod
+    def _get_cache_key(
+            sorting: SimpleSorting,
+            pagination: DefaultPagination | KeysetPagination,
+            cache_version: int
+    ) -> str:
+        # the first page is the same for both types of pagination
+        if isinstance(pagination, DefaultPagination):
+            page = pagination.offset
+        elif pagination.is_first_page:
+            page = 0
+        else:
+            page = f"after_{pagination.after_value}_{pagination.after_id}"
+
+        return USERS_CACHE_KEY_TEMPLATE.format(cache_version, sorting.sort_by, sorting.order, pagination.limit, page)
+
+    @classmethod
+    async def get_profile(cls, session: AsyncSession, user_id: int) -> UserRead | None:
+        profiles = await cls.get_profiles(session, [user_id])
+
+        return profiles.get(user_id)
+
+    @classmethod
+    async def get_profiles(cls, session: AsyncSession, user_ids: list[int]) -> dict[int, UserRead]:
+        """
+        Profiles are taken from the cache, and only the missing ones are loaded from the database and cached.
+        If redis is unavailable, all profiles are loaded from the database.
+
+        :return: Profiles of existing users by their IDs.
+        """
+
+        profiles = {}
+        cache_generations = {}
+        for user_id in user_ids:
+            cache_key = USER_PROFILE_CACHE_KEY_TEMPLATE.format(id=user_id)
+            cache_generations[user_id] = local_cache.get_generation(cache_key)
+
+            profile = local_cache.get(cache_key)
+            if profile is not None:
+                profiles[user_id] = profile
+
+        not_locally_cached_user_ids = [user_id for user_id in user_ids if user_id not in profiles]
+        if not_locally_cached_user_ids:
+            cache_keys = [USER_PROFILE_CACHE_KEY_TEMPLATE.format(id=user_id) for user_id in not_locally_cached_user_ids]
+            try:
+                cached_profiles = await redis_client.mget(cache_keys)
+
+            except RedisConnectionError as e:
+                traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                logger.warning(f"Connection to redis failed while getting profiles. More details:\n{traceback_message}")
+
+                cached_profiles = [None] * len(cache_keys)
+
+            for user_id, cache_key, cached_profile in zip(not_locally_cached_user_ids, cache_keys, cached_profiles):
+                if cached_profile:
+                    profiles[user_id] = UserRead.model_validate_json(cached_profile)
+                    local_cache.set(
+                        cache_key,
+                        profiles[user_id],
+                        len(cached_profile),
+                        tag=cache_key,
+                        generation=cache_generations[user_id]
+                    )
+
+        not_cached_user_ids = [user_id for user_id in user_ids if user_id not in profiles]
+        if not_cached_user_ids:
+            with cls.reading_from_primary(session):
+                users = await session.scalars(select(User).where(User.id.in_(not_cached_user_ids)))
+            loaded_profiles = {user.id: UserRead.model_validate(user) for user in users}
+            profiles.update(loaded_profiles)
+
+            try:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    for user_id, profile in loaded_profiles.items():
+                        pipe.set(
+                            USER_PROFILE_CACHE_KEY_TEMPLATE.format(id=user_id),
+                            profile.model_dump_json(),
+                            ex=USER_PROFILE_CACHE_TTL
+                        )
+
+                    await pipe.execute()
+
+            except RedisConnectionError:
+                logger.warning("Connection to redis failed while saving profiles to the cache!")
+
+        return profiles
+
+    @classmethod
+    async def invalidate_profile(cls, user_id: int) -> None:
+        cache_key = USER_PROFILE_CACHE_KEY_TEMPLATE.format(id=user_id)
+
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(cache_key)
+            await local_cache.invalidate(cache_key, pipe)
+            await pipe.execute()
@@ -0,0 +1,111 @@
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import msgpack
+from pydantic import BaseModel
+
+from main_app import serialization
+from main_app.config import settings
+
+
+NAIVE_DATETIME_EXT_CODE = 1
+UTC_DATETIME_EXT_CODE = 2
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class JSONCodec:
+    """
+    The format that was used before the codecs were added, so its payloads have no version byte.
+    """
+
+    def encode(self, value: Any) -> bytes:
+        return serialization.dumps(value)
+
+    def decode(self, data: bytes) -> Any:
+        return serialization.loads(data)
+
+
+class MsgPackCodec:
+    """
+    MessagePack with datetimes packed as 8-byte integers of microseconds since the epoch. Payloads start with
+    the version byte.
+    """
+
+    version = b"\x01"
+
+    def encode(self, value: Any) -> bytes:
+        return self.version + msgpack.packb(value, default=self._pack_extension)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data[1:], ext_hook=self._unpack_extension)
+
+    @staticmethod
+    def _pack_extension(value: Any) -> Any:
+        if isinstance(value, BaseModel):
+            return value.model_dump()
+
+        if isinstance(value, datetime):
+            if value.tzinfo is None:
+                return msgpack.ExtType(NAIVE_DATETIME_EXT_CODE, struct.pack(">q", to_microseconds(value)))
+
+            utc_value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            return msgpack.ExtType(UTC_DATETIME_EXT_CODE, struct.pack(">q", to_microseconds(utc_value)))
+
+        raise TypeError(f"Object of type {type(value).__name__} can't be packed")
+
+    @staticmethod
+    def _unpack_extension(code: int, data: bytes) -> Any:
+        if code == NAIVE_DATETIME_EXT_CODE:
+            return from_microseconds(struct.unpack(">q", data)[0])
+
+        if code == UTC_DATETIME_EXT_CODE:
+            return from_microseconds(struct.unpack(">q", data)[0]).replace(tzinfo=timezone.utc)
+
+        return msgpack.ExtType(code, data)
+
+
+def to_microseconds(value: datetime) -> int:
+    return (value - EPOCH) // timedelta.resolution
+
+
+def from_microseconds(microseconds: int) -> datetime:
+    return EPOCH + timedelta(microseconds=microseconds)
+
+
+CODECS = {
+    "json": JSONCodec(),
+    "msgpack": MsgPackCodec()
+}
+
+
+def encode(value: Any) -> bytes:
+    """
+    Encodes the value for redis with the codec chosen in the settings.
+    """
+
+    return CODECS[settings.REDIS_CODEC].encode(value)
+
+
+def decode(data: bytes) -> Any:
+    """
+    Payloads of all formats are decoded, so processes that write different formats can work together during
+    a rolling deploy.
+    """
+
+    if data[:1] == MsgPackCodec.version:
+        return CODECS["msgpack"].decode(data)
+
+    return CODECS["json"].decode(data)
+
+
+def to_json(data: bytes) -> bytes:
+    """
+    Converts a payload of any format to JSON, e.g. for websocket frames. JSON payloads are returned as is.
+    """
+
+    if data[:1] == MsgPackCodec.version:
+        return serialization.dumps(CODECS["msgpack"].decode(data))
+
+    return data
@@ -1,4 +1,5 @@
 import logging
+from typing import Literal
 
 from celery import Celery
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -24,14 +25,80 @@ class Settings(BaseSettings):
     REDIS_HOST: str
     REDIS_PORT: str
 
+    # connection pools of every process, so the total number of connections depends on the number of workers
+    DB_POOL_SIZE: int = 5
+    DB_POOL_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    # connections older than this number of seconds are reopened, -1 disables it
+    DB_POOL_RECYCLE: int = -1
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # for connecting through PgBouncer in the transaction mode: the pool and the statement caches are disabled
+    DB_PGBOUNCER_MODE: bool = False
+    # "host:port" of read-only replicas, the reads of GET requests go to them
+    DB_REPLICAS: list[str] = []
+    # a replica that falls behind the primary more than this number of seconds is not used until it catches up
+    DB_REPLICA_MAX_LAG: float = 5
+    DB_REPLICA_CHECK_INTERVAL: float = 2
+    # reads of a user go to the primary during this number of seconds after their write
+    DB_READ_YOUR_WRITES_WINDOW: float = 10
+
+    REDIS_MAX_CONNECTIONS: int = 50
+    # how long to wait for a free redis connection when all of them are in use
+    REDIS_POOL_TIMEOUT: float = 5
+
     NOTIFICATION_SERVICE_HOST: str
     NOTIFICATION_SERVICE_PORT: int
 
+    # write-behind persistence of messages received through websockets. The IDs are reserved in blocks, so
+    # with several processes they are not strictly ordered by time (see "MESSAGES_IDS_RESERVATION_TTL")
+    MESSAGES_WRITE_BEHIND_ENABLED: bool = False
+    MESSAGES_WRITE_BEHIND_BATCH_SIZE: int = 500
+    MESSAGES_WRITE_BEHIND_FLUSH_INTERVAL: float = 0.05
+    MESSAGES_WRITE_BEHIND_QUEUE_SIZE: int = 10000
+
+    # every websocket has a queue of outgoing frames, when it is full the connection is considered slow:
+    # "drop_oldest" discards the oldest frames, "disconnect" closes the socket, so the client reloads the history
+    WEBSOCKET_OUTBOUND_QUEUE_SIZE: int = 256
+    WEBSOCKET_SLOW_CONSUMER_POLICY: Literal["drop_oldest", "disconnect"] = "disconnect"
+
+    # the partitions of messages are created in advance and archived by a periodic task, the partitions whose
+    # messages are older than this number of days are moved to the archive, None disables the archiving
+    MESSAGES_PARTITIONS_MAINTENANCE_INTERVAL: float = 3600
+    MESSAGES_ARCHIVE_AFTER_DAYS: int | None = None
+
+    # messages sent to an offline user during this number of seconds are merged into one notification
+    NOTIFICATIONS_AGGREGATION_WINDOW: int = 60
+    # a notification that the notification service hasn't accepted is retried after the number of seconds that
+    # the service has asked for or after the default delay if it is unavailable
+    NOTIFICATIONS_DELIVERY_MAX_RETRIES: int = 10
+    NOTIFICATIONS_DELIVERY_RETRY_DELAY: int = 30
+
+    # responses are encoded with orjson instead of the standard json module
+    ORJSON_RESPONSES_ENABLED: bool = True
+
+    # format of cached messages and pub/sub payloads, all formats are always readable, so during a rolling deploy
+    # the new format should be enabled only after all processes can read it
+    REDIS_CODEC: Literal["json", "msgpack"] = "json"
+
+    # in-process cache in front of redis
+    LOCAL_CACHE_TTL: float = 5
+    LOCAL_CACHE_MAX_SIZE: int = 16 * 1024 * 1024
+
+    # every celery worker process runs async tasks in one event loop with reused connections
+    CELERY_PERSISTENT_EVENT_LOOP: bool = True
+
     @property
     def db_connection_url_async(self):
         return ("postgresql+asyncpg://"
                 f"{self.DB_USER_NAME}:{self.DB_USER_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}")
 
+    @property
+    def db_replica_connection_urls_async(self):
+        return [
+            f"postgresql+asyncpg://{self.DB_USER_NAME}:{self.DB_USER_PASSWORD}@{replica}/{self.DB_NAME}"
+            for replica in self.DB_REPLICAS
+        ]
+
     @property
     def redis_connection_url(self):
         return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}"
@@ -53,3 +120,9 @@ settings = Settings()
 
 celery_manager = Celery("tasks", broker=settings.redis_connection_url)
 celery_manager.autodiscover_tasks(['main_app.messenger.tasks'])
+celery_manager.conf.beat_schedule = {
+    "maintain-message-partitions": {
+        "task": "main_app.messenger.tasks.maintain_message_partitions",
+        "schedule": settings.MESSAGES_PARTITIONS_MAINTENANCE_INTERVAL
+    }
+}
@@ -1,22 +1,74 @@
 from datetime import datetime
 from typing import Annotated, Literal
 
-import aioredis
-from sqlalchemy import String
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+from sqlalchemy import String, Select, UpdateBase
 from sqlalchemy.dialects.postgresql import TIMESTAMP
-from sqlalchemy.ext.asyncio import AsyncAttrs, create_async_engine, async_sessionmaker
-from sqlalchemy.orm import DeclarativeBase, mapped_column
+from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase, Session, mapped_column
 
-from main_app.config import settings
+from main_app.config import settings, logger
+from main_app.pools import get_engine_options, create_redis_client
+from main_app.replicas import ReplicaSet
 
 
-async_engine = create_async_engine(settings.db_connection_url_async)
-async_sessionmaker_instance = async_sessionmaker(async_engine, expire_on_commit=False)
+redis_client = create_redis_client(encoding="utf-8", decode_responses=True)
+# for values encoded with "main_app.codec"
+redis_binary_client = create_redis_client()
 
-redis_client = aioredis.from_url(
-    settings.redis_connection_url,
-    encoding="utf-8",
-    decode_responses=True
+async_engine = create_async_engine(settings.db_connection_url_async, **get_engine_options())
+replica_set = ReplicaSet(
+    async_engine,
+    settings.db_replica_connection_urls_async,
+    redis_client,
+    max_lag=settings.DB_REPLICA_MAX_LAG,
+    check_interval=settings.DB_REPLICA_CHECK_INTERVAL,
+    read_your_writes_window=settings.DB_READ_YOUR_WRITES_WINDOW
+)
+
+
+class RoutingSession(Session):
+    """
+    If "use_replica" is set in the session info, plain SELECTs go to a replica. Everything else, and also reads
+    after the session has written anything, goes to the primary.
+    """
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["has_writes"] = True
+
+        elif (
+                self.info.get("use_replica")
+                and not self.info.get("has_writes")
+                and isinstance(clause, Select)
+                and clause._for_update_arg is None
+        ):
+            replica = replica_set.choose()
+            if replica is not None:
+                return replica.sync_engine
+
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+class RoutingAsyncSession(AsyncSession):
+    async def commit(self) -> None:
+        await super().commit()
+
+        # "user_id" is set in the session info when the session is used on behalf of a user
+        user_id = self.info.get("user_id")
+        if replica_set.is_enabled and user_id is not None and self.info.get("has_writes"):
+            try:
+                await replica_set.pin_to_primary(user_id)
+
+            except RedisConnectionError as e:
+                logger.warning(f"Failed to pin user with ID {user_id} to the primary database: {e}")
+
+
+async_sessionmaker_instance = async_sessionmaker(
+    async_engine,
+    class_=RoutingAsyncSession,
+    sync_session_class=RoutingSession,
+    expire_on_commit=False
 )
 
 
@@ -1,10 +1,16 @@
 from typing import AsyncGenerator
 
+from fastapi import Request
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from main_app.database import async_sessionmaker_instance
 
 
-async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+async def get_async_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Reads of GET requests go to the replicas if they are configured.
+    """
+
     async with async_sessionmaker_instance() as async_session:
+        async_session.info["use_replica"] = request.method in ("GET", "HEAD")
         yield async_session
@@ -15,3 +15,19 @@ class ColumnDoesNotExistError(Exception):
 
     def __str__(self) -> str:
         return self.msg
+
+
+class ColumnIsNotSortableError(Exception):
+    def __init__(self, column_name: str):
+        self.msg = f"Sorting by column '{column_name}' is not supported, because the column is not indexed."
+
+    def __str__(self) -> str:
+        return self.msg
+
+
+class InvalidCursorError(Exception):
+    def __init__(self, cursor: str):
+        self.msg = f"Cursor '{cursor}' is invalid."
+
+    def __str__(self) -> str:
+        return self.msg
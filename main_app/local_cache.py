@@ -0,0 +1,135 @@
+import time
+from collections import OrderedDict
+from typing import Any
+
+from aioredis.client import Pipeline
+
+from main_app.config import settings
+from main_app.messenger.services.pubsub_service import PubSubService
+
+
+LOCAL_CACHE_INVALIDATION_CHANNEL = "local_cache:invalidation"
+
+
+class LocalCache:
+    """
+    In-process TTL + LRU cache in front of redis. Every entry has a tag (e.g. the redis key it was read from),
+    and writers invalidate tags through a redis channel, so the entries are dropped by all processes. The TTL
+    bounds the staleness if an invalidation is missed.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        """
+        :param max_size: Approximate limit of the memory used by values in bytes.
+        """
+
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._entries: OrderedDict[str, tuple[Any, int, float, str]] = OrderedDict()
+        self._keys_by_tags: dict[str, set[str]] = {}
+        self._size = 0
+        # entries that have been read from redis before an invalidation of their tag are not saved. Generations
+        # of the tags invalidated more than TTL seconds ago are forgotten, so a read can't take longer than the TTL.
+        self._generation = 0
+        self._generations: OrderedDict[str, tuple[int, float]] = OrderedDict()
+
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get_generation(self, tag: str) -> int:
+        """
+        Must be received before reading the value from redis and passed to "set".
+        """
+
+        generation = self._generations.get(tag)
+
+        return 0 if generation is None else generation[0]
+
+    def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[2] < time.monotonic():
+            if entry is not None:
+                self._delete(key)
+
+            self._counters["misses"] += 1
+
+            return None
+
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+
+        return entry[0]
+
+    def set(self, key: str, value: Any, size: int, tag: str, generation: int) -> None:
+        """
+        :param size: Approximate size of the value in bytes, e.g. the length of the string it was decoded from.
+        """
+
+        if generation != self.get_generation(tag) or size > self.max_size:
+            return
+
+        self._delete(key)
+
+        self._entries[key] = (value, size, time.monotonic() + self.ttl, tag)
+        self._keys_by_tags.setdefault(tag, set()).add(key)
+        self._size += size
+
+        while self._size > self.max_size:
+            self._delete(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    async def invalidate(self, tag: str, pipe: Pipeline | None = None) -> None:
+        """
+        Drops the entries of the tag in this process and broadcasts the invalidation to other processes.
+
+        :param pipe: If passed, the command is only queued in this pipeline and the caller executes it.
+        """
+
+        self.invalidate_locally(tag)
+
+        await PubSubService.send(LOCAL_CACHE_INVALIDATION_CHANNEL, tag, pipe)
+
+    def invalidate_locally(self, tag: str) -> None:
+        now = time.monotonic()
+
+        # the generations are taken from one counter, so a forgotten generation is never reused
+        self._generation += 1
+        self._generations.pop(tag, None)
+        self._generations[tag] = (self._generation, now)
+        while next(iter(self._generations.values()))[1] < now - self.ttl:
+            self._generations.popitem(last=False)
+
+        self._counters["invalidations"] += 1
+
+        for key in self._keys_by_tags.pop(tag, set()):
+            self._delete(key)
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            **self._counters,
+            "entries": len(self._entries),
+            "size": self._size,
+            "max_size": self.max_size
+        }
+
+    def _delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        _, size, _, tag = entry
+        self._size -= size
+
+        keys = self._keys_by_tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tags[tag]
+
+
+local_cache = LocalCache(ttl=settings.LOCAL_CACHE_TTL, max_size=settings.LOCAL_CACHE_MAX_SIZE)
+
+
+@PubSubService.listen
+async def listen_invalidations(tag: bytes) -> None:
+    local_cache.invalidate_locally(tag.decode())
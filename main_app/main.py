@@ -1,11 +1,23 @@
-from fastapi import FastAPI, HTTPException, Request
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.exception_handlers import http_exception_handler
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, RedirectResponse
 
+from main_app.auth.dependencies import current_admin_user
+from main_app.auth.models import User
 from main_app.auth.router import auth_router, users_router
+from main_app.config import settings
+from main_app.database import async_engine, redis_client, redis_binary_client, replica_set
+from main_app.local_cache import local_cache, listen_invalidations, LOCAL_CACHE_INVALIDATION_CHANNEL
 from main_app.messenger.router import messanger_router
+from main_app.messenger.services.ingest_service import message_ingest_service
+from main_app.messenger.services.presence_service import PresenceService
+from main_app.messenger.services.pubsub_service import PubSubService
+from main_app.messenger.services.websocket_service import WebsocketService
 
 tags_metadata = [
     {
@@ -27,9 +39,47 @@ tags_metadata = [
             For users who are not an admin (superuser), only the "/users/me" methods are available.
         """,
     },
+    {
+        "name": "Metrics",
+        "description": """
+            Runtime metrics of the process that handles the request. Available only to admins (superusers).
+        """,
+    },
 ]
 
-app = FastAPI(title="Messenger", openapi_tags=tags_metadata)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.MESSAGES_WRITE_BEHIND_ENABLED:
+        await message_ingest_service.start()
+
+    listen_invalidations_task = asyncio.create_task(
+        listen_invalidations(channel_name=LOCAL_CACHE_INVALIDATION_CHANNEL)
+    )
+
+    await replica_set.start()
+
+    yield
+
+    await replica_set.stop()
+
+    listen_invalidations_task.cancel()
+    await listen_invalidations_task
+
+    # buffered messages are flushed before the process exits
+    if message_ingest_service.is_running:
+        await message_ingest_service.stop()
+
+    await PresenceService.close()
+    await PubSubService.close()
+
+
+app = FastAPI(
+    title="Messenger",
+    openapi_tags=tags_metadata,
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if settings.ORJSON_RESPONSES_ENABLED else JSONResponse
+)
 app.mount('/static', StaticFiles(directory='main_app/static'), name='static')
 
 origins = [
@@ -46,7 +96,8 @@ app.add_middleware(
         "Access-Control-Allow-Headers",
         "Access-Control-Allow-Origin",
         "Authorization"
-    ]
+    ],
+    expose_headers=["X-Next-Cursor"]
 )
 
 app.include_router(
@@ -67,6 +118,25 @@ async def redirect_to_auth():
     return RedirectResponse(url="/auth")
 
 
+@app.get("/metrics", tags=["Metrics"])
+async def get_metrics(current_user: User = Depends(current_admin_user)):
+    """
+    Counters of the current process.
+    """
+
+    return {
+        "local_cache": local_cache.get_stats(),
+        "websockets": WebsocketService.get_metrics(),
+        # the pools should be sized for the number of concurrent queries, not for the number of sockets
+        "pools": {
+            "database": async_engine.pool.get_stats(),
+            "redis": redis_client.connection_pool.get_stats(),
+            "redis_binary": redis_binary_client.connection_pool.get_stats()
+        },
+        "replicas": replica_set.get_stats()
+    }
+
+
 @app.exception_handler(HTTPException)
 async def handle_401_unauthorized(request: Request, exc: HTTPException):
     if exc.status_code == 401:
@@ -1,6 +1,41 @@
 CHAT_PUBSUB_NAME_TEMPLATE = "chat:{min_user_id}:{max_user_id}"
+USER_PUBSUB_NAME_TEMPLATE = "user:{user_id}"
+CONVERSATION_ID_TEMPLATE = "{min_user_id}:{max_user_id}"
 
-MESSAGES_CACHE_KEY_TEMPLATE = "messages:{sender_id}:{recipient_id}"
+# a socket of a slow client is closed with this code, after reconnecting the client must reload the history
+WEBSOCKET_RESYNC_CLOSE_CODE = 4000
+WEBSOCKET_RESYNC_CLOSE_REASON = "resync"
+
+MESSAGES_CACHE_KEY_TEMPLATE = "messages:chat:{min_user_id}:{max_user_id}"
 MESSAGES_CACHE_TTL = 1800
+# the oldest messages are removed from the cache when the limit is exceeded
+MESSAGES_CACHE_MAX_SIZE = 1000
+
+MESSAGES_ID_SEQUENCE = "message_id_seq"
+# how many message IDs are reserved at once by the write-behind persistence
+MESSAGES_IDS_BLOCK_SIZE = 100
+# unused reserved IDs are dropped after this number of seconds. Each process takes IDs from its own block, so
+# with several processes the IDs of a conversation are ordered by time only within this interval: a message
+# may get a smaller ID than a message stored before it, and a client catching up with "after_id" may miss it
+MESSAGES_IDS_RESERVATION_TTL = 5
+
+MESSAGES_PARTITION_NAME_TEMPLATE = "message_p{number}"
+# empty partitions that always exist after the one that receives new messages
+MESSAGES_PARTITIONS_AHEAD = 2
+
+# the configuration doesn't depend on the language: words are only lowercased, without stemming and stop words
+MESSAGES_SEARCH_CONFIG = "simple"
+MESSAGES_SEARCH_HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=15, MinWords=5"
 
-SESSIONS_COUNT_KEY_TEMPLATE = "sessions:user_id_{id}"
+PRESENCE_KEY_TEMPLATE = "presence:user_id_{id}"
+# a connection that has not been refreshed for this number of seconds is considered closed
+PRESENCE_TTL = 30
+PRESENCE_HEARTBEAT_INTERVAL = 10
+PRESENCE_LOCAL_CACHE_TTL = 2
+# the oldest statuses are removed from the local cache when the limit is exceeded
+PRESENCE_LOCAL_CACHE_MAX_SIZE = 10000
+NOTIFICATIONS_PENDING_KEY_TEMPLATE = "notifications:pending:user_id_{id}"
+# exists while a notification for the user is scheduled, so at most one notification is sent per window
+NOTIFICATIONS_WINDOW_KEY_TEMPLATE = "notifications:window:user_id_{id}"
+# at most this number of senders is listed in a notification
+NOTIFICATIONS_MAX_SENDERS_NAMES = 3
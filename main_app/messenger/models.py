@@ -1,17 +1,83 @@
 from datetime import datetime
 
-from sqlalchemy import ForeignKey, Text
+from sqlalchemy import ForeignKey, Index, Text, text
+from sqlalchemy.engine.default import DefaultExecutionContext
 from sqlalchemy.orm import Mapped, mapped_column
 
 from main_app.database import BaseDbModel, IntPk
+from main_app.messenger.constants import MESSAGES_SEARCH_CONFIG
 
 
-class Message(BaseDbModel):
-    __tablename__ = "message"
+def get_min_user_id(context: DefaultExecutionContext) -> int:
+    parameters = context.get_current_parameters()
+
+    return min(parameters["sender_id"], parameters["recipient_id"])
+
+
+def get_max_user_id(context: DefaultExecutionContext) -> int:
+    parameters = context.get_current_parameters()
+
+    return max(parameters["sender_id"], parameters["recipient_id"])
+
+
+class MessageBase(BaseDbModel):
+    __abstract__ = True
 
     id: Mapped[IntPk]
     sender_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"))
     recipient_id: Mapped[int] = mapped_column(ForeignKey("user.id", ondelete="CASCADE"))
+    min_user_id: Mapped[int] = mapped_column(default=get_min_user_id)
+    max_user_id: Mapped[int] = mapped_column(default=get_max_user_id)
     text_content: Mapped[str] = mapped_column(Text, nullable=False)
     created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
     updated_at: Mapped[datetime | None] = mapped_column(onupdate=datetime.utcnow)
+
+
+class Message(MessageBase):
+    """
+    The table is partitioned by ID ranges, the partitions are maintained by "MessagePartitionService".
+    """
+
+    __tablename__ = "message"
+    __table_args__ = (
+        # the conversation key: all messages between two users are read with a single index range scan
+        Index("ix_message_conversation", "min_user_id", "max_user_id", text("id DESC")),
+        # the full-text search in the conversations of a user, the expression must be the same in the search
+        # queries to use the indexes. The user IDs are indexed by GIN with the "btree_gin" extension.
+        Index(
+            "ix_message_min_user_id_text_search",
+            "min_user_id",
+            text(f"to_tsvector('{MESSAGES_SEARCH_CONFIG}', text_content)"),
+            postgresql_using="gin"
+        ),
+        Index(
+            "ix_message_max_user_id_text_search",
+            "max_user_id",
+            text(f"to_tsvector('{MESSAGES_SEARCH_CONFIG}', text_content)"),
+            postgresql_using="gin"
+        ),
+        {"postgresql_partition_by": "RANGE (id)"}
+    )
+
+
+class MessageArchive(MessageBase):
+    """
+    Messages of old partitions, which are moved here if the archiving is enabled.
+    """
+
+    __tablename__ = "message_archive"
+    __table_args__ = (
+        Index("ix_message_archive_conversation", "min_user_id", "max_user_id", text("id DESC")),
+        Index(
+            "ix_message_archive_min_user_id_text_search",
+            "min_user_id",
+            text(f"to_tsvector('{MESSAGES_SEARCH_CONFIG}', text_content)"),
+            postgresql_using="gin"
+        ),
+        Index(
+            "ix_message_archive_max_user_id_text_search",
+            "max_user_id",
+            text(f"to_tsvector('{MESSAGES_SEARCH_CONFIG}', text_content)"),
+            postgresql_using="gin"
+        ),
+    )
@@ -1,11 +1,11 @@
 import asyncio
 import traceback
 
-from fastapi import APIRouter, Depends, Request, HTTPException
-from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Depends, Request, HTTPException, Query, Response, status
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.websockets import WebSocket
+from pydantic import ValidationError
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from aioredis.exceptions import ConnectionError as RedisConnectionError
@@ -14,18 +14,19 @@ from main_app.auth.dependencies import current_active_user
 from main_app.auth.models import User
 from main_app.auth.schemas import UserRead
 from main_app.auth.router import get_users_list
-from main_app.database import redis_client
+from main_app.auth.services.auth_service import get_websocket_user
 from main_app.dependencies import get_async_session
 from main_app.config import settings, logger
+from main_app.exceptions import InvalidCursorError
 from main_app.messenger.constants import (
     CHAT_PUBSUB_NAME_TEMPLATE,
-    MESSAGES_CACHE_KEY_TEMPLATE,
-    SESSIONS_COUNT_KEY_TEMPLATE
+    USER_PUBSUB_NAME_TEMPLATE
 )
-from main_app.messenger.schemas import MessageRead
+from main_app.messenger.schemas import MessageRead, MessageReadList, MessageSearchResult, MessageSearchResultList
 from main_app.messenger.services.message_service import MessageService
+from main_app.messenger.services.presence_service import PresenceService
 from main_app.messenger.services.websocket_service import WebsocketService
-from main_app.pagination import DefaultPagination
+from main_app.pagination import DefaultPagination, CursorPagination, RankedPagination
 
 
 messanger_router = APIRouter(prefix="/messenger", tags=["Messenger"])
@@ -36,6 +37,7 @@ templates = Jinja2Templates(directory=settings.TEMPLATES_PATH)
 @messanger_router.get("/", response_class=HTMLResponse, summary="Страница чата")
 async def get_messenger_page(
         request: Request,
+        response: Response,
         current_user: User = Depends(current_active_user),
         users: list[UserRead] = Depends(get_users_list)
 ):
@@ -44,7 +46,9 @@ async def get_messenger_page(
         {
             "request": request,
             "current_user": current_user,
-            "users": users
+            "users": users,
+            # the cursor of the next page of users is set by the "get_users_list" dependency
+            "users_cursor": response.headers.get("X-Next-Cursor")
         }
     )
 
@@ -53,47 +57,97 @@ async def get_messenger_page(
 async def get_messages_between_users_by_second_user_id(
         second_user_id: int,
         pagination: DefaultPagination = Depends(),
+        before_id: int | None = Query(None, gt=0, description="Return messages older than the specified one"),
+        after_id: int | None = Query(None, ge=0, description="Return messages newer than the specified one"),
+        cursor: str | None = Query(None, description="Value of the 'X-Next-Cursor' header of the previous page"),
         session: AsyncSession = Depends(get_async_session),
         current_user: User = Depends(current_active_user)
 ):
-    cache_key = MESSAGES_CACHE_KEY_TEMPLATE.format(sender_id=current_user.id, recipient_id=second_user_id)
-    try:
-        cached_messages = await MessageService.get_cache(
-            cache_key,
-            DefaultPagination(limit=pagination.limit, offset=pagination.offset)
-        )
+    """
+    Offset pagination is kept for compatibility. If the offset is not specified, the keyset (cursor) pagination
+    is used, and the cursor of the next page is returned in the 'X-Next-Cursor' header.
+    """
+
+    is_cursor_requested = cursor is not None or before_id is not None or after_id is not None
+    if is_cursor_requested and pagination.offset:
+        raise HTTPException(status_code=400, detail={
+            "status": "error",
+            "details": "Offset can not be combined with the cursor pagination."
+        })
+
+    cursor_pagination = None
+    if is_cursor_requested or not pagination.offset:
+        try:
+            if cursor is not None:
+                cursor_pagination = CursorPagination.from_cursor(cursor, pagination.limit)
+            else:
+                cursor_pagination = CursorPagination(limit=pagination.limit, before_id=before_id, after_id=after_id)
+
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail={
+                "status": "error",
+                "details": str(e)
+            })
+
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail={
+                "status": "error",
+                "details": e.errors(include_url=False, include_context=False, include_input=False)
+            })
 
-        if not cached_messages:
-            messages = await MessageService.get_between_two_users(
+    next_cursor = None
+    cache_key = MessageService.get_cache_key(current_user.id, second_user_id)
+    try:
+        if cursor_pagination:
+            messages = await MessageService.get_page(
                 session,
+                cache_key,
                 current_user.id,
                 second_user_id,
-                DefaultPagination(limit=pagination.limit, offset=pagination.offset)
+                cursor_pagination
             )
-            if messages:
-                messages = [MessageRead.model_validate(message) for message in messages]
-                await MessageService.update_cache(cache_key, messages)
+
+            if len(messages) == cursor_pagination.limit:
+                next_cursor = cursor_pagination.get_next_cursor(
+                    messages[0].id,
+                    messages[-1].id
+                )
 
         else:
-            messages = cached_messages
-            messages_count = len(cached_messages)
+            cached_messages = await MessageService.get_cache(
+                cache_key,
+                DefaultPagination(limit=pagination.limit, offset=pagination.offset)
+            )
 
-            if messages_count < pagination.limit:
-                new_messages = await MessageService.get_between_two_users(
+            # the cache must hold a contiguous range of the latest messages, so the pages of the offset pagination
+            # are only read from it, and the messages read from the database are not cached
+            if not cached_messages:
+                messages = await MessageService.get_between_two_users(
                     session,
                     current_user.id,
                     second_user_id,
-                    DefaultPagination(
-                        limit=pagination.limit - messages_count,
-                        offset=pagination.offset + messages_count
-                    )
+                    DefaultPagination(limit=pagination.limit, offset=pagination.offset)
                 )
+                messages = [MessageRead.model_validate(message) for message in messages]
+
+            else:
+                messages = cached_messages
+                messages_count = len(cached_messages)
 
-                if new_messages:
-                    messages = [MessageRead.model_validate(message) for message in new_messages]
-                    await MessageService.update_cache(cache_key, messages)
+                if messages_count < pagination.limit:
+                    new_messages = await MessageService.get_between_two_users(
+                        session,
+                        current_user.id,
+                        second_user_id,
+                        DefaultPagination(
+                            limit=pagination.limit - messages_count,
+                            offset=pagination.offset + messages_count
+                        )
+                    )
 
-                    messages.extend(cached_messages)
+                    if new_messages:
+                        messages = [MessageRead.model_validate(message) for message in new_messages]
+                        messages.extend(cached_messages)
 
     except RedisConnectionError as e:
         traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
@@ -104,11 +158,17 @@ async def get_messages_between_users_by_second_user_id(
             session,
             current_user.id,
             second_user_id,
-            DefaultPagination(limit=pagination.limit, offset=pagination.offset)
+            cursor_pagination or DefaultPagination(limit=pagination.limit, offset=pagination.offset)
         )
         if messages:
             messages = [MessageRead.model_validate(message) for message in messages]
 
+            if cursor_pagination and len(messages) == cursor_pagination.limit:
+                next_cursor = cursor_pagination.get_next_cursor(
+                    messages[0].id,
+                    messages[-1].id
+                )
+
     except IntegrityError as e:
         traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
         logger.error(f"User with ID {current_user.id} or {second_user_id} does not exist."
@@ -128,40 +188,135 @@ async def get_messages_between_users_by_second_user_id(
             "details": "..."
         })
 
-    json_valid_messages = jsonable_encoder(messages)
+    # the messages are serialized once, without the validation against the response model
+    return Response(
+        content=MessageReadList.dump_json(messages),
+        media_type="application/json",
+        headers={"X-Next-Cursor": next_cursor} if next_cursor else None
+    )
+
+
+@messanger_router.get("/search", response_model=list[MessageSearchResult])
+async def search_messages(
+        q: str = Query(..., min_length=1, max_length=256, description="Words or quoted phrases to search for"),
+        limit: int = Query(5, gt=0, le=100),
+        cursor: str | None = Query(None, description="Value of the 'X-Next-Cursor' header of the previous page"),
+        session: AsyncSession = Depends(get_async_session),
+        current_user: User = Depends(current_active_user)
+):
+    """
+    Searches the messages of all conversations of the current user. The most relevant messages come first, the
+    cursor of the next page is returned in the 'X-Next-Cursor' header.
+    """
+
+    try:
+        if cursor is not None:
+            pagination = RankedPagination.from_cursor(cursor, limit)
+        else:
+            pagination = RankedPagination(limit=limit)
+
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail={
+            "status": "error",
+            "details": str(e)
+        })
+
+    try:
+        rows = await MessageService.search(session, current_user.id, q, pagination)
+        results = MessageSearchResultList.validate_python(rows, from_attributes=True)
+
+    except Exception as e:
+        traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        logger.error(f"Details:\n{traceback_message}")
+
+        raise HTTPException(status_code=500, detail={
+            "status": "error",
+            "details": "..."
+        })
+
+    next_cursor = None
+    if len(results) == pagination.limit:
+        next_cursor = pagination.get_next_cursor(results[-1].rank, results[-1].id)
 
-    return json_valid_messages
+    return Response(
+        content=MessageSearchResultList.dump_json(results),
+        media_type="application/json",
+        headers={"X-Next-Cursor": next_cursor} if next_cursor else None
+    )
 
 
 @messanger_router.websocket("/ws")
 async def websocket_endpoint(
         websocket: WebSocket,
-        recipient_id: int,
-        current_user_id: int,
-        session_marker: bool = False,
-        session: AsyncSession = Depends(get_async_session)
+        current_user_id: int | None = None,
+        recipient_id: int | None = None,
+        session_marker: bool = False
 ):
-    websocket_service = WebsocketService(websocket)
+    """
+    Without the "recipient_id" the socket is multiplexed: it carries messages of all conversations of the user,
+    each tagged with the "conversation_id", and also marks the user as online.
+    Sockets with the "recipient_id" (one per chat) and the "session_marker" sockets are kept for compatibility.
+
+    The user is authenticated by the "auth" cookie. The "current_user_id" is kept for compatibility, the socket
+    is rejected if it doesn't match the authenticated user.
+    """
+
+    current_user = await get_websocket_user(websocket)
+    if current_user is None or current_user_id not in (None, current_user.id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+
+        return
+
+    current_user_id = current_user.id
+
+    is_multiplexed = recipient_id is None
+    marks_session = session_marker or is_multiplexed
+
+    # only the multiplexed sockets are used by the clients that accept coalesced frames
+    websocket_service = WebsocketService(websocket, coalesce_frames=is_multiplexed)
     await websocket_service.connect()
 
-    sessions_count_redis_key = SESSIONS_COUNT_KEY_TEMPLATE.format(id=current_user_id)
-    if session_marker:
-        await redis_client.incr(sessions_count_redis_key, 1)
+    if marks_session:
+        connection_id = await PresenceService.connect(current_user_id)
 
-    pubsub_name = CHAT_PUBSUB_NAME_TEMPLATE.format(
-        min_user_id=min(current_user_id, recipient_id),
-        max_user_id=max(current_user_id, recipient_id)
-    )
+    if is_multiplexed:
+        pubsub_name = USER_PUBSUB_NAME_TEMPLATE.format(user_id=current_user_id)
+    else:
+        pubsub_name = CHAT_PUBSUB_NAME_TEMPLATE.format(
+            min_user_id=min(current_user_id, recipient_id),
+            max_user_id=max(current_user_id, recipient_id)
+        )
 
     listen_pubsub_task = asyncio.create_task(websocket_service.handle_messages_from_pubsub(channel_name=pubsub_name))
 
-    await websocket_service.listen(session, current_user_id, pubsub_name, session_marker)
+    try:
+        await websocket_service.listen(current_user_id, session_marker)
+
+    finally:
+        listen_pubsub_task.cancel()
+        await websocket_service.disconnect()
 
-    listen_pubsub_task.cancel()
+        if marks_session:
+            await PresenceService.disconnect(connection_id)
 
-    if session_marker:
-        await redis_client.decr(sessions_count_redis_key, 1)
 
-        sessions_count = await redis_client.get(sessions_count_redis_key)
-        if int(sessions_count) <= 0:
-            await redis_client.delete(sessions_count_redis_key)
+@messanger_router.get("/presence", response_model=dict[int, bool])
+async def get_users_presence(
+        user_ids: list[int] = Query(..., max_length=100),
+        current_user: User = Depends(current_active_user)
+):
+    """
+    Returns online statuses of the requested users.
+    """
+
+    try:
+        return await PresenceService.get_statuses(user_ids)
+
+    except RedisConnectionError as e:
+        traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        logger.error(f"Redis connection error. More details:\n{traceback_message}")
+
+        raise HTTPException(status_code=503, detail={
+            "status": "error",
+            "details": "Online statuses are temporarily unavailable."
+        })
@@ -1,6 +1,7 @@
 from datetime import datetime
+from typing import Literal
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, TypeAdapter
 
 
 class MessageRead(BaseModel):
@@ -14,6 +15,31 @@ class MessageRead(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+MessageReadList = TypeAdapter(list[MessageRead])
+
+
+class MessageSearchResult(MessageRead):
+    """
+    "headline" is the text fragments with the found words highlighted by <b> tags. The text itself is HTML-escaped,
+    so the headline is safe to insert as HTML.
+    """
+
+    headline: str
+    rank: float
+
+
+MessageSearchResultList = TypeAdapter(list[MessageSearchResult])
+
+
+class MessageEvent(MessageRead):
+    """
+    A message as it is sent to websockets.
+    """
+
+    conversation_id: str | None = None
+    status: Literal["OK", "error"] = "OK"
+
+
 class MessageCreate(BaseModel):
     sender_id: int
     recipient_id: int
@@ -0,0 +1,180 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from main_app.config import settings, logger
+from main_app.database import async_sessionmaker_instance
+from main_app.messenger.constants import MESSAGES_IDS_BLOCK_SIZE, MESSAGES_IDS_RESERVATION_TTL
+from main_app.messenger.schemas import MessageCreate, MessageRead
+from main_app.messenger.services.message_service import MessageService
+
+
+class MessageIngestService:
+    """
+    Write-behind persistence of new messages.
+
+    A message gets its final ID from a block reserved in advance and is returned to the caller at once, so it can be
+    published before it is stored. Messages are buffered in a bounded per-process queue and inserted in bulk when
+    the batch is full or the flush interval has passed. The returned future is resolved when the message is
+    committed, or gets the exception if it could not be stored.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue_size: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+
+        self._queue: asyncio.Queue[tuple[MessageRead, asyncio.Future]] | None = None
+        self._flush_task: asyncio.Task | None = None
+        self._is_accepting = False
+
+        self._reserved_ids: deque[int] = deque()
+        self._reserved_at = 0.0
+        self._reserve_ids_lock = asyncio.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._is_accepting
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+        self._is_accepting = True
+
+        logger.info("Write-behind persistence of messages has started.")
+
+    async def stop(self) -> None:
+        """
+        Stops accepting new messages and waits until all buffered messages are flushed.
+        """
+
+        self._is_accepting = False
+
+        await self._queue.join()
+        self._flush_task.cancel()
+
+        logger.info("Write-behind persistence of messages has stopped.")
+
+    async def put(self, values: MessageCreate) -> tuple[MessageRead, asyncio.Future]:
+        """
+        Waits for free space in the queue if it is full.
+
+        :return: The message with its final ID and the future that is resolved after the message is stored.
+        """
+
+        if not self._is_accepting:
+            raise RuntimeError("Write-behind persistence of messages is not running")
+
+        message = MessageRead(
+            id=await self._get_id(),
+            created_at=datetime.utcnow(),
+            **values.model_dump()
+        )
+        is_stored = asyncio.get_running_loop().create_future()
+        await self._queue.put((message, is_stored))
+
+        return message, is_stored
+
+    async def _get_id(self) -> int:
+        async with self._reserve_ids_lock:
+            if not self._reserved_ids or time.monotonic() - self._reserved_at > MESSAGES_IDS_RESERVATION_TTL:
+                async with async_sessionmaker_instance() as session:
+                    ids = await MessageService.allocate_ids(session, MESSAGES_IDS_BLOCK_SIZE)
+
+                self._reserved_ids = deque(ids)
+                self._reserved_at = time.monotonic()
+
+            return self._reserved_ids.popleft()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._flush(batch)
+
+            except Exception as e:
+                traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                logger.error(f"Failed to store a batch of {len(batch)} messages. More details:\n{traceback_message}")
+
+                for _, is_stored in batch:
+                    self._resolve(is_stored, exception=e)
+
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: list[tuple[MessageRead, asyncio.Future]]) -> None:
+        # a message whose sending has been cancelled is not stored
+        batch = [(message, is_stored) for message, is_stored in batch if not is_stored.cancelled()]
+        if not batch:
+            return
+
+        async with async_sessionmaker_instance() as session:
+            try:
+                await MessageService.bulk_create(session, [self._to_row(message) for message, _ in batch])
+
+            except SQLAlchemyError as e:
+                traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                logger.warning(f"Failed to store a batch of {len(batch)} messages, retrying them one by one. "
+                               f"More details:\n{traceback_message}")
+
+                await session.rollback()
+
+            else:
+                for message, is_stored in batch:
+                    self._resolve(is_stored, message)
+
+                return
+
+            # the messages are retried one by one, so that one invalid message does not fail the whole batch
+            for message, is_stored in batch:
+                try:
+                    await MessageService.bulk_create(session, [self._to_row(message)])
+
+                except SQLAlchemyError as e:
+                    await session.rollback()
+                    self._resolve(is_stored, exception=e)
+
+                else:
+                    self._resolve(is_stored, message)
+
+    @staticmethod
+    def _to_row(message: MessageRead) -> dict:
+        return message.model_dump(exclude={"updated_at"})
+
+    @staticmethod
+    def _resolve(
+            is_stored: asyncio.Future,
+            message: MessageRead | None = None,
+            exception: Exception | None = None
+    ) -> None:
+        if is_stored.done():
+            return
+
+        if exception:
+            is_stored.set_exception(exception)
+        else:
+            is_stored.set_result(message)
+
+
+message_ingest_service = MessageIngestService(
+    batch_size=settings.MESSAGES_WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.MESSAGES_WRITE_BEHIND_FLUSH_INTERVAL,
+    max_queue_size=settings.MESSAGES_WRITE_BEHIND_QUEUE_SIZE
+)
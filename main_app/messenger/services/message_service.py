@@ -1,15 +1,22 @@
-import json
-
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy import select, or_, and_
+from aioredis.client import Pipeline
+from sqlalchemy import ColumnElement, Row, Select, and_, func, literal_column, or_, select, tuple_, union_all
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased
 
-from main_app.database import redis_client
-from main_app.messenger.constants import MESSAGES_CACHE_TTL
-from main_app.messenger.models import Message
+from main_app import codec
+from main_app.config import settings
+from main_app.database import redis_client, redis_binary_client
+from main_app.messenger.constants import (
+    MESSAGES_CACHE_KEY_TEMPLATE,
+    MESSAGES_CACHE_TTL,
+    MESSAGES_CACHE_MAX_SIZE,
+    MESSAGES_ID_SEQUENCE,
+    MESSAGES_SEARCH_CONFIG,
+    MESSAGES_SEARCH_HEADLINE_OPTIONS
+)
+from main_app.messenger.models import Message, MessageArchive, MessageBase
 from main_app.messenger.schemas import MessageCreate, MessageUpdate, MessageRead
-from main_app.pagination import DefaultPagination
+from main_app.pagination import DefaultPagination, CursorPagination, RankedPagination
 from main_app.service import BaseDAO
 
 
@@ -20,106 +27,352 @@ class MessageService(BaseDAO[Message, MessageCreate, MessageUpdate], model=Messa
             session: AsyncSession,
             first_user_id: int,
             second_user_id: int,
-            pagination: DefaultPagination | None = None
-    ) -> list[Message] | None:
-        subquery = (
-            select(Message)
+            pagination: DefaultPagination | CursorPagination | None = None
+    ) -> list[MessageBase] | None:
+        """
+        If the archiving is enabled, pages of all types are read from both the partitioned table and the archive,
+        so the history is never cut at the oldest partition.
+        """
+
+        models = [Message]
+        if settings.MESSAGES_ARCHIVE_AFTER_DAYS is not None:
+            models.append(MessageArchive)
+
+        return await cls._get_conversation_page(session, models, first_user_id, second_user_id, pagination)
+
+    @staticmethod
+    async def _get_conversation_page(
+            session: AsyncSession,
+            models: list[type[MessageBase]],
+            first_user_id: int,
+            second_user_id: int,
+            pagination: DefaultPagination | CursorPagination | None = None
+    ) -> list[MessageBase]:
+        """
+        The conditions on IDs limit the query to the partitions that contain the page. Each table returns messages
+        up to the end of the page in the order of the page, and the page is taken from the union of them ordered
+        by ID.
+        """
+
+        is_forward = isinstance(pagination, CursorPagination) and not pagination.is_backward
+        offset = pagination.offset if isinstance(pagination, DefaultPagination) else 0
+
+        page_queries = []
+        for model in models:
+            page_query = (
+                select(model)
+                .where(
+                    model.min_user_id == min(first_user_id, second_user_id),
+                    model.max_user_id == max(first_user_id, second_user_id)
+                )
+                .order_by(model.id.asc() if is_forward else model.id.desc())
+            )
+            if is_forward:
+                page_query = page_query.where(model.id > pagination.after_id)
+            elif isinstance(pagination, CursorPagination) and pagination.before_id is not None:
+                page_query = page_query.where(model.id < pagination.before_id)
+
+            if pagination:
+                page_query = page_query.limit(offset + pagination.limit)
+            page_queries.append(page_query)
+
+        subquery = (union_all(*page_queries) if len(page_queries) > 1 else page_queries[0]).subquery()
+
+        aliased_message = aliased(models[0], subquery)
+        query = select(aliased_message).order_by(aliased_message.id.asc() if is_forward else aliased_message.id.desc())
+        if pagination:
+            query = query.limit(pagination.limit).offset(offset)
+
+        messages = list((await session.scalars(query)).all())
+        if not is_forward:
+            messages.reverse()
+
+        return messages
+
+    @classmethod
+    async def search(
+            cls,
+            session: AsyncSession,
+            user_id: int,
+            search_query: str,
+            pagination: RankedPagination
+    ) -> list[Row]:
+        """
+        Full-text search in the conversations of the user. The results are ordered by the rank and then by ID,
+        the keyset pagination uses the rank as the sort value. Highlighting is the most expensive part, so it is
+        done only for the messages of the returned page.
+
+        :param search_query: Web search syntax: quoted phrases, "or" and "-" before excluded words are supported.
+        """
+
+        ts_query = func.websearch_to_tsquery(cls._get_search_config(), search_query)
+
+        matches_query = cls._get_search_query(Message, user_id, ts_query)
+        if settings.MESSAGES_ARCHIVE_AFTER_DAYS is not None:
+            matches_query = union_all(matches_query, cls._get_search_query(MessageArchive, user_id, ts_query))
+        matches = matches_query.subquery()
+
+        page_query = select(matches).order_by(matches.c.rank.desc(), matches.c.id.desc()).limit(pagination.limit)
+        if not pagination.is_first_page:
+            page_query = page_query.where(
+                tuple_(matches.c.rank, matches.c.id) < tuple_(pagination.after_value, pagination.after_id)
+            )
+        page = page_query.subquery()
+
+        query = (
+            select(
+                page,
+                func.ts_headline(
+                    cls._get_search_config(),
+                    cls._escape_html(page.c.text_content),
+                    ts_query,
+                    MESSAGES_SEARCH_HEADLINE_OPTIONS
+                ).label("headline")
+            )
+            .order_by(page.c.rank.desc(), page.c.id.desc())
+        )
+
+        results = await session.execute(query)
+
+        return list(results.all())
+
+    @classmethod
+    def _get_search_query(cls, model: type[MessageBase], user_id: int, ts_query: ColumnElement) -> Select:
+        """
+        Each condition matches a multicolumn GIN index of a user ID and the text, so only the matches in the
+        conversations of the user are read (a bitmap OR of two index scans) and ranked.
+        """
+
+        ts_vector = func.to_tsvector(cls._get_search_config(), model.text_content)
+        is_matched = ts_vector.bool_op("@@")(ts_query)
+
+        return (
+            select(
+                model.id,
+                model.sender_id,
+                model.recipient_id,
+                model.text_content,
+                model.created_at,
+                model.updated_at,
+                func.ts_rank(ts_vector, ts_query).label("rank")
+            )
             .where(
                 or_(
-                    and_(Message.recipient_id == second_user_id, Message.sender_id == first_user_id),
-                    and_(Message.recipient_id == first_user_id, Message.sender_id == second_user_id)
+                    and_(model.min_user_id == user_id, is_matched),
+                    and_(model.max_user_id == user_id, is_matched)
                 )
             )
-            .order_by(Message.id.desc())
         )
-        if pagination:
-            subquery = subquery.limit(pagination.limit).offset(pagination.offset)
-        subquery = subquery.subquery()
 
-        aliased_message = aliased(Message, subquery)
-        query = select(aliased_message).order_by(aliased_message.id.asc())
+    @staticmethod
+    def _escape_html(text: ColumnElement) -> ColumnElement:
+        """
+        The text is escaped before highlighting, so only the tags added by "ts_headline" are left in the headline.
+        Entities are parsed as single tokens, so fragments never cut them.
+        """
+
+        # the ampersand goes first, otherwise the entities would be escaped again
+        for character, entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#39;")):
+            text = func.replace(text, character, entity)
 
-        messages = await session.scalars(query)
+        return text
 
-        return messages.all()
+    @staticmethod
+    def _get_search_config() -> ColumnElement:
+        # a literal instead of a bound parameter, so the expression matches the one of the index
+        return literal_column(f"'{MESSAGES_SEARCH_CONFIG}'")
 
     @classmethod
-    async def add_new_message_to_cache(
+    async def allocate_ids(cls, session: AsyncSession, count: int) -> list[int]:
+        """
+        Reserves IDs from the primary key sequence, so messages can get their final IDs before they are inserted.
+        """
+
+        query = select(func.nextval(MESSAGES_ID_SEQUENCE)).select_from(func.generate_series(1, count))
+        ids = await session.scalars(query)
+
+        return ids.all()
+
+    @classmethod
+    async def get_page(
             cls,
-            message: MessageRead,
-            sender_cache_key: str,
-            recipient_cache_key: str
-    ) -> None:
-        json_valid_message = jsonable_encoder(message)
+            session: AsyncSession,
+            cache_key: str,
+            first_user_id: int,
+            second_user_id: int,
+            pagination: CursorPagination
+    ) -> list[MessageRead]:
+        """
+        Returns a page of the history between two users, reading it from the cache where possible.
 
-        sender_cached_messages = await redis_client.get(sender_cache_key)
+        The cache always holds a contiguous range of the latest messages. So if a page reaches the beginning of
+        the cache, its missing part is loaded from the database and prepended to the cache. Pages outside the cached
+        range are read from the database only.
+        """
 
-        if sender_cached_messages:
-            messages = json.loads(sender_cached_messages)
-            messages.append(json_valid_message)
+        cached_messages = await cls.get_cache(cache_key, pagination)
 
-            await redis_client.set(sender_cache_key, json.dumps(messages), ex=MESSAGES_CACHE_TTL)
+        if cached_messages is None:
+            is_latest_page = pagination.is_backward and pagination.before_id is None
+            # the latest page is put into the cache, so it must not miss the messages that a replica hasn't received
+            with cls.reading_from_primary(session, enabled=is_latest_page):
+                messages = await cls.get_between_two_users(session, first_user_id, second_user_id, pagination)
+            messages = [MessageRead.model_validate(message) for message in messages]
 
-        else:
-            await redis_client.set(sender_cache_key, json.dumps([json_valid_message]), ex=MESSAGES_CACHE_TTL)
+            if messages and is_latest_page:
+                await cls.update_cache(cache_key, messages)
 
-        recipient_cached_messages = await redis_client.get(recipient_cache_key)
+            return messages
 
-        if recipient_cached_messages:
-            messages = json.loads(recipient_cached_messages)
-            messages.append(json_valid_message)
+        messages_count = len(cached_messages)
+        if pagination.is_backward and messages_count < pagination.limit:
+            # messages older than the cached range had been stored before the range was cached, so they can be
+            # read from a replica
+            new_messages = await cls.get_between_two_users(
+                session,
+                first_user_id,
+                second_user_id,
+                CursorPagination(
+                    limit=pagination.limit - messages_count,
+                    before_id=cached_messages[0].id if cached_messages else pagination.before_id
+                )
+            )
 
-            ttl = await redis_client.ttl(recipient_cache_key)
-            await redis_client.set(recipient_cache_key, json.dumps(messages), ex=ttl)
+            if new_messages:
+                messages = [MessageRead.model_validate(message) for message in new_messages]
+                await cls.update_cache(cache_key, messages)
+
+                messages.extend(cached_messages)
+
+                return messages
+
+        return cached_messages
 
     @classmethod
-    async def set_cache(cls, key: str, messages: list[MessageRead]) -> None:
-        json_valid_messages = jsonable_encoder(messages)
+    async def add_new_message_to_cache(cls, message: MessageRead, cache_key: str, pipe: Pipeline | None = None) -> None:
+        """
+        :param pipe: If passed, the commands are only queued in this pipeline and the caller executes it.
+        """
+
+        if pipe is None:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                await cls.add_new_message_to_cache(message, cache_key, pipe)
+                await pipe.execute()
 
-        await redis_client.set(key, json.dumps(json_valid_messages), ex=MESSAGES_CACHE_TTL)
+            return
+
+        pipe.zadd(cache_key, {cls._to_cache_entry(message): message.id})
+        pipe.zremrangebyrank(cache_key, 0, -MESSAGES_CACHE_MAX_SIZE - 1)
+        pipe.expire(cache_key, MESSAGES_CACHE_TTL)
 
     @classmethod
-    async def get_cache(cls, key: str, pagination: DefaultPagination | None = None) -> list[MessageRead] | None:
-        cached_messages = await redis_client.get(key)
-        try:
-            cached_messages = json.loads(cached_messages)
-        except TypeError:
-            cached_messages = None
+    async def remove_from_cache(cls, message_id: int, cache_key: str) -> None:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(cache_key, message_id, message_id)
+            await pipe.execute()
 
-        if cached_messages and pagination:
-            cache_len = len(cached_messages)
-            if cache_len >= pagination.offset + pagination.limit:
-                last_message_index = cache_len - pagination.offset
-                first_message_index = cache_len - pagination.offset - pagination.limit
+    @classmethod
+    async def set_cache(cls, key: str, messages: list[MessageRead]) -> None:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if messages:
+                pipe.zadd(key, {cls._to_cache_entry(message): message.id for message in messages})
+                pipe.zremrangebyrank(key, 0, -MESSAGES_CACHE_MAX_SIZE - 1)
+                pipe.expire(key, MESSAGES_CACHE_TTL)
+            await pipe.execute()
 
-                return cached_messages[first_message_index : last_message_index]
+    @classmethod
+    async def get_cache(
+            cls,
+            key: str,
+            pagination: DefaultPagination | CursorPagination | None = None
+    ) -> list[MessageRead] | None:
+        """
+        The cache is a sorted set where each message is stored as a separate member with its ID as the score,
+        so only the requested page is read from redis. It is not kept in the local cache, since every new message
+        changes the latest page and would have to be broadcast to all processes.
+
+        With the cursor pagination returns None if the requested page is outside the cached range. An empty list
+        means that the cache is up to date, but there are no messages after the "after_id".
+        """
 
-            elif cache_len > pagination.offset:
-                last_message_index = cache_len - pagination.offset
+        if isinstance(pagination, CursorPagination):
+            async with redis_binary_client.pipeline(transaction=False) as pipe:
+                pipe.zrange(key, 0, 0, withscores=True, score_cast_func=int)
+                if pagination.is_backward:
+                    upper_bound = "+inf" if pagination.before_id is None else f"({pagination.before_id}"
+                    pipe.zrevrangebyscore(key, upper_bound, "-inf", start=0, num=pagination.limit)
+                else:
+                    pipe.zrangebyscore(key, f"({pagination.after_id}", "+inf", start=0, num=pagination.limit)
 
-                return cached_messages[ : last_message_index]
+                first_cached_message, page = await pipe.execute()
 
-            else:
+            if not first_cached_message:
                 return None
 
+            first_cached_id = first_cached_message[0][1]
+            if pagination.is_backward:
+                if pagination.before_id is not None and pagination.before_id < first_cached_id:
+                    return None
+
+                page.reverse()
+
+            elif pagination.after_id < first_cached_id:
+                return None
+
+            return [MessageRead.model_validate(codec.decode(message)) for message in page]
+
+        elif pagination:
+            cached_messages = await redis_binary_client.zrevrange(
+                key,
+                pagination.offset,
+                pagination.offset + pagination.limit - 1
+            )
+            cached_messages.reverse()
+
         else:
-            return cached_messages
+            cached_messages = await redis_binary_client.zrange(key, 0, -1)
+
+        if cached_messages:
+            return [MessageRead.model_validate(codec.decode(message)) for message in cached_messages]
+        else:
+            return None
 
     @classmethod
     async def update_cache(cls, key: str, messages: list[MessageRead]) -> None:
-        json_valid_messages = jsonable_encoder(messages)
+        """
+        Adds older messages to the cache. Members are unique, so the messages that are already cached are not
+        duplicated.
+        """
 
-        cached_messages = await redis_client.get(key)
-        if cached_messages:
-            cached_messages = json.loads(cached_messages)
-            json_valid_messages.extend(cached_messages)
+        if not messages:
+            return
 
-        await redis_client.set(key, json.dumps(json_valid_messages), ex=MESSAGES_CACHE_TTL)
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {cls._to_cache_entry(message): message.id for message in messages})
+            pipe.zremrangebyrank(key, 0, -MESSAGES_CACHE_MAX_SIZE - 1)
+            pipe.expire(key, MESSAGES_CACHE_TTL)
+            await pipe.execute()
 
     @classmethod
     async def cache_exists(cls, key: str) -> bool:
-        cached_messages = await redis_client.get(key)
-        if cached_messages:
+        cached_messages_count = await redis_client.exists(key)
+        if cached_messages_count:
             return True
         else:
             return False
+
+    @staticmethod
+    def get_cache_key(first_user_id: int, second_user_id: int) -> str:
+        """
+        Both users of a conversation share the same cache entry.
+        """
+
+        return MESSAGES_CACHE_KEY_TEMPLATE.format(
+            min_user_id=min(first_user_id, second_user_id),
+            max_user_id=max(first_user_id, second_user_id)
+        )
+
+    @staticmethod
+    def _to_cache_entry(message: MessageRead) -> bytes:
+        return codec.encode(message)
@@ -0,0 +1,134 @@
+from main_app.config import settings
+from main_app.database import redis_client
+from main_app.messenger.constants import NOTIFICATIONS_PENDING_KEY_TEMPLATE, NOTIFICATIONS_WINDOW_KEY_TEMPLATE
+
+
+# KEYS: the pending hash and the window key, ARGV: the sender and the TTL of the window. If the scheduled
+# notification is lost, the pending messages are dropped and the window is closed one window later, so the next
+# message schedules a new notification. The TTL is only extended, since a notification can be postponed for longer.
+ADD_PENDING_SCRIPT = """
+redis.call("HINCRBY", KEYS[1], ARGV[1], 1)
+if redis.call("TTL", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+
+if redis.call("SET", KEYS[2], 1, "EX", ARGV[2], "NX") then
+    return 1
+end
+
+return 0
+"""
+
+# KEYS: the pending hash and the window key, ARGV: the TTL of the window and pairs of senders and their
+# acknowledged numbers of messages
+ACKNOWLEDGE_SCRIPT = """
+for i = 2, #ARGV, 2 do
+    if redis.call("HINCRBY", KEYS[1], ARGV[i], -tonumber(ARGV[i + 1])) <= 0 then
+        redis.call("HDEL", KEYS[1], ARGV[i])
+    end
+end
+
+local remaining_senders_count = redis.call("HLEN", KEYS[1])
+if remaining_senders_count == 0 then
+    redis.call("DEL", KEYS[1], KEYS[2])
+else
+    redis.call("SET", KEYS[2], 1, "EX", ARGV[1])
+    redis.call("EXPIRE", KEYS[1], ARGV[1])
+end
+
+return remaining_senders_count
+"""
+
+
+class NotificationService:
+    """
+    Notifications about messages sent to an offline user are debounced per recipient. The senders of the messages
+    are counted in the recipient's pending hash, and only the first message of a window schedules a notification,
+    which is sent when the window ends and includes all messages received in the meantime.
+    """
+
+    @classmethod
+    async def add_pending(cls, recipient_id: int, sender_id: int, sender_full_name: str) -> bool:
+        """
+        The sender's name is stored with the pending message, so the notification can be sent without
+        database lookups.
+
+        :return: True if a new window has been opened, so the caller must schedule a notification in
+            NOTIFICATIONS_AGGREGATION_WINDOW seconds.
+        """
+
+        is_window_opened = await redis_client.eval(
+            ADD_PENDING_SCRIPT,
+            2,
+            NOTIFICATIONS_PENDING_KEY_TEMPLATE.format(id=recipient_id),
+            NOTIFICATIONS_WINDOW_KEY_TEMPLATE.format(id=recipient_id),
+            f"{sender_id}:{sender_full_name}",
+            settings.NOTIFICATIONS_AGGREGATION_WINDOW * 2
+        )
+
+        return bool(is_window_opened)
+
+    @classmethod
+    async def get_pending(cls, recipient_id: int) -> dict[str, int]:
+        """
+        The pending messages stay in redis until the notification about them is accepted by the notification
+        service and they are acknowledged.
+
+        :return: Numbers of messages by the sender fields of the pending hash.
+        """
+
+        pending_messages = await redis_client.hgetall(NOTIFICATIONS_PENDING_KEY_TEMPLATE.format(id=recipient_id))
+
+        return {sender: int(count) for sender, count in pending_messages.items()}
+
+    @classmethod
+    async def acknowledge(cls, recipient_id: int, pending_messages: dict[str, int]) -> bool:
+        """
+        Removes the messages that the notification has been sent about. The messages received while it was being
+        sent are kept.
+
+        :param pending_messages: The result of "get_pending".
+        :return: True if there are new pending messages, so the caller must schedule one more notification in
+            NOTIFICATIONS_AGGREGATION_WINDOW seconds. Otherwise the window is closed, so the next message opens
+            a new one.
+        """
+
+        arguments = [value for sender, count in pending_messages.items() for value in (sender, count)]
+        remaining_senders_count = await redis_client.eval(
+            ACKNOWLEDGE_SCRIPT,
+            2,
+            NOTIFICATIONS_PENDING_KEY_TEMPLATE.format(id=recipient_id),
+            NOTIFICATIONS_WINDOW_KEY_TEMPLATE.format(id=recipient_id),
+            settings.NOTIFICATIONS_AGGREGATION_WINDOW * 2,
+            *arguments
+        )
+
+        return remaining_senders_count > 0
+
+    @classmethod
+    async def postpone(cls, recipient_id: int, delay: int) -> None:
+        """
+        Keeps the pending messages and the window until the notification is retried after the delay.
+        """
+
+        ttl = delay + settings.NOTIFICATIONS_AGGREGATION_WINDOW * 2
+
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.expire(NOTIFICATIONS_PENDING_KEY_TEMPLATE.format(id=recipient_id), ttl)
+            pipe.expire(NOTIFICATIONS_WINDOW_KEY_TEMPLATE.format(id=recipient_id), ttl)
+            await pipe.execute()
+
+    @staticmethod
+    def group_by_senders(pending_messages: dict[str, int]) -> dict[int, tuple[str, int]]:
+        """
+        :return: The sender's full name and the number of messages by sender IDs.
+        """
+
+        senders = {}
+        for sender, count in pending_messages.items():
+            sender_id, sender_full_name = sender.split(":", 1)
+            # the sender could change the name during the window
+            _, previous_count = senders.get(int(sender_id), (None, 0))
+            senders[int(sender_id)] = (sender_full_name, previous_count + count)
+
+        return senders
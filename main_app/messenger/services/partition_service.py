@@ -0,0 +1,161 @@
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from main_app.config import logger
+from main_app.messenger.constants import (
+    MESSAGES_ID_SEQUENCE,
+    MESSAGES_PARTITION_NAME_TEMPLATE,
+    MESSAGES_PARTITIONS_AHEAD
+)
+
+
+PARTITION_BOUNDS_PATTERN = re.compile(r"FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+
+ARCHIVED_COLUMNS = "id, sender_id, recipient_id, text_content, created_at, updated_at, min_user_id, max_user_id"
+
+
+class MessagePartitionService:
+    """
+    The "message" table is partitioned by ID ranges. Partitions for the IDs that are not allocated yet are created
+    in advance, and old partitions can be moved to the "message_archive" table, so the main table and its indexes
+    don't grow without bound.
+
+    The methods must be called with a connection in the autocommit mode, since a partition is detached without
+    blocking writes only outside a transaction.
+    """
+
+    @classmethod
+    async def get_partitions(
+            cls,
+            connection: AsyncConnection,
+            pending_detach: bool = False
+    ) -> list[tuple[str, int, int]]:
+        """
+        :param pending_detach: Return only the partitions whose concurrent detaching has been interrupted instead of
+            the attached ones.
+        :return: Names, lower (inclusive) and upper (exclusive) bounds of the partitions ordered by their bounds.
+        """
+
+        rows = await connection.execute(
+            text(
+                "SELECT partition.relname, pg_get_expr(partition.relpartbound, partition.oid) "
+                "FROM pg_inherits "
+                "JOIN pg_class AS partition ON partition.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = 'message'::regclass "
+                "AND pg_inherits.inhdetachpending = :pending_detach"
+            ),
+            {"pending_detach": pending_detach}
+        )
+
+        partitions = []
+        for name, bounds in rows:
+            lower_bound, upper_bound = PARTITION_BOUNDS_PATTERN.search(bounds).groups()
+            partitions.append((name, int(lower_bound), int(upper_bound)))
+
+        return sorted(partitions, key=lambda partition: partition[1])
+
+    @classmethod
+    async def create_partitions_ahead(cls, connection: AsyncConnection) -> list[str]:
+        """
+        Makes sure that there are at least "MESSAGES_PARTITIONS_AHEAD" empty partitions after the one that receives
+        new messages. The new partitions have the same size as the last one.
+
+        :return: Names of the created partitions.
+        """
+
+        _, lower_bound, upper_bound = (await cls.get_partitions(connection))[-1]
+        partition_size = upper_bound - lower_bound
+        last_id = await cls._get_last_allocated_id(connection)
+
+        created_partitions = []
+        while upper_bound <= last_id + MESSAGES_PARTITIONS_AHEAD * partition_size:
+            name = MESSAGES_PARTITION_NAME_TEMPLATE.format(number=upper_bound // partition_size)
+            await connection.execute(text(
+                f"CREATE TABLE {name} PARTITION OF message "
+                f"FOR VALUES FROM ({upper_bound}) TO ({upper_bound + partition_size})"
+            ))
+
+            created_partitions.append(name)
+            upper_bound += partition_size
+
+        if created_partitions:
+            logger.info(f"Partitions of messages are created: {', '.join(created_partitions)}.")
+
+        return created_partitions
+
+    @classmethod
+    async def archive_partitions(cls, connection: AsyncConnection, older_than: datetime) -> list[str]:
+        """
+        Moves the partitions whose newest message is older than the date to the archive. The partition that
+        receives new messages is never archived.
+
+        :return: Names of the archived partitions.
+        """
+
+        archived_partitions = []
+
+        # a partition stays pending detach if the previous run has been interrupted, and it can't be detached again
+        for name, lower_bound, upper_bound in await cls.get_partitions(connection, pending_detach=True):
+            await connection.execute(text(f"ALTER TABLE message DETACH PARTITION {name} FINALIZE"))
+            await cls._move_to_archive(connection, name, lower_bound, upper_bound)
+
+            archived_partitions.append(name)
+
+        last_id = await cls._get_last_allocated_id(connection)
+
+        for name, lower_bound, upper_bound in await cls.get_partitions(connection):
+            if upper_bound > last_id:
+                break
+
+            newest_message_date = await connection.scalar(text(
+                f"SELECT created_at FROM {name} ORDER BY id DESC LIMIT 1"
+            ))
+            # the next partitions have newer messages
+            if newest_message_date is not None and newest_message_date >= older_than:
+                break
+
+            # the messages are copied before the partition is detached, so the history doesn't miss them meanwhile
+            await connection.execute(text(
+                f"INSERT INTO message_archive ({ARCHIVED_COLUMNS}) "
+                f"SELECT {ARCHIVED_COLUMNS} FROM {name} "
+                "ON CONFLICT (id) DO NOTHING"
+            ))
+            await connection.execute(text(f"ALTER TABLE message DETACH PARTITION {name} CONCURRENTLY"))
+            await cls._move_to_archive(connection, name, lower_bound, upper_bound)
+
+            archived_partitions.append(name)
+
+        if archived_partitions:
+            logger.info(f"Partitions of messages are archived: {', '.join(archived_partitions)}.")
+
+        return archived_partitions
+
+    @staticmethod
+    async def _move_to_archive(connection: AsyncConnection, name: str, lower_bound: int, upper_bound: int) -> None:
+        """
+        Copies the detached partition to the archive again, since its messages could be edited or deleted after
+        the first copy until the partition was detached, and drops it.
+        """
+
+        await connection.execute(text(
+            f"INSERT INTO message_archive ({ARCHIVED_COLUMNS}) "
+            f"SELECT {ARCHIVED_COLUMNS} FROM {name} "
+            "ON CONFLICT (id) DO UPDATE SET "
+            "text_content = EXCLUDED.text_content, updated_at = EXCLUDED.updated_at"
+        ))
+        await connection.execute(
+            text(
+                "DELETE FROM message_archive "
+                "WHERE id >= :lower_bound AND id < :upper_bound "
+                f"AND NOT EXISTS (SELECT FROM {name} WHERE {name}.id = message_archive.id)"
+            ),
+            {"lower_bound": lower_bound, "upper_bound": upper_bound}
+        )
+        await connection.execute(text(f"DROP TABLE {name}"))
+
+    @staticmethod
+    async def _get_last_allocated_id(connection: AsyncConnection) -> int:
+        return await connection.scalar(text(f"SELECT last_value FROM {MESSAGES_ID_SEQUENCE}"))
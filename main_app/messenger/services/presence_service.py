@@ -0,0 +1,147 @@
+import asyncio
+import time
+import traceback
+from uuid import uuid4
+
+from aioredis.client import Pipeline
+from aioredis.exceptions import RedisError
+
+from main_app.config import logger
+from main_app.database import redis_client
+from main_app.messenger.constants import (
+    PRESENCE_KEY_TEMPLATE,
+    PRESENCE_TTL,
+    PRESENCE_HEARTBEAT_INTERVAL,
+    PRESENCE_LOCAL_CACHE_TTL,
+    PRESENCE_LOCAL_CACHE_MAX_SIZE
+)
+
+
+class PresenceService:
+    """
+    Each connection of a user is a member of the user's sorted set with its expiration time as the score, and
+    the user is online while the set has members that have not expired. The connections of the process are
+    refreshed by a single heartbeat task, so if the process crashes, its connections are not refreshed anymore
+    and the user goes offline within PRESENCE_TTL seconds.
+    """
+
+    _connections: dict[str, int] = {}
+    _heartbeat_task: asyncio.Task | None = None
+    _local_cache: dict[int, tuple[bool, float]] = {}
+
+    @classmethod
+    async def connect(cls, user_id: int) -> str:
+        """
+        :return: ID of the connection that must be passed to the "disconnect" method.
+        """
+
+        connection_id = uuid4().hex
+        cls._connections[connection_id] = user_id
+        cls._local_cache.pop(user_id, None)
+
+        await cls._refresh({connection_id: user_id})
+
+        if cls._heartbeat_task is None or cls._heartbeat_task.done():
+            cls._heartbeat_task = asyncio.create_task(cls._send_heartbeats())
+
+        return connection_id
+
+    @classmethod
+    async def disconnect(cls, connection_id: str) -> None:
+        user_id = cls._connections.pop(connection_id, None)
+        if user_id is not None:
+            cls._local_cache.pop(user_id, None)
+
+            await redis_client.zrem(PRESENCE_KEY_TEMPLATE.format(id=user_id), connection_id)
+
+    @classmethod
+    async def is_online(cls, user_id: int, pipe: Pipeline | None = None) -> bool | None:
+        """
+        :param pipe: If passed, the command is only queued in this pipeline and the caller executes it. The number
+            of live connections of the user is the result of the command.
+        """
+
+        if pipe is None:
+            statuses = await cls.get_statuses([user_id])
+
+            return statuses[user_id]
+
+        pipe.zcount(PRESENCE_KEY_TEMPLATE.format(id=user_id), time.time(), "+inf")
+
+    @classmethod
+    async def get_statuses(cls, user_ids: list[int]) -> dict[int, bool]:
+        """
+        Returns online statuses of many users for one round-trip to redis. Statuses that have been received less
+        than PRESENCE_LOCAL_CACHE_TTL seconds ago are taken from the local cache.
+        """
+
+        now = time.time()
+
+        statuses = {}
+        for user_id in user_ids:
+            cached_status = cls._local_cache.get(user_id)
+            if cached_status is None:
+                continue
+
+            if cached_status[1] > now:
+                statuses[user_id] = cached_status[0]
+            else:
+                del cls._local_cache[user_id]
+
+        not_cached_user_ids = [user_id for user_id in user_ids if user_id not in statuses]
+        if not_cached_user_ids:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for user_id in not_cached_user_ids:
+                    pipe.zcount(PRESENCE_KEY_TEMPLATE.format(id=user_id), now, "+inf")
+
+                connections_counts = await pipe.execute()
+
+            for user_id, connections_count in zip(not_cached_user_ids, connections_counts):
+                statuses[user_id] = connections_count > 0
+                cls._local_cache[user_id] = (statuses[user_id], now + PRESENCE_LOCAL_CACHE_TTL)
+
+            # the dict keeps the insertion order, and all statuses have the same TTL, so the first ones expire first
+            while len(cls._local_cache) > PRESENCE_LOCAL_CACHE_MAX_SIZE:
+                del cls._local_cache[next(iter(cls._local_cache))]
+
+        return statuses
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._heartbeat_task:
+            cls._heartbeat_task.cancel()
+
+        for connection_id in list(cls._connections):
+            await cls.disconnect(connection_id)
+
+    @classmethod
+    async def _refresh(cls, connections: dict[str, int]) -> None:
+        now = time.time()
+
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for connection_id, user_id in connections.items():
+                presence_key = PRESENCE_KEY_TEMPLATE.format(id=user_id)
+
+                pipe.zadd(presence_key, {connection_id: now + PRESENCE_TTL})
+                # connections of crashed processes
+                pipe.zremrangebyscore(presence_key, "-inf", now)
+                pipe.expire(presence_key, PRESENCE_TTL)
+
+            await pipe.execute()
+
+    @classmethod
+    async def _send_heartbeats(cls) -> None:
+        while cls._connections:
+            await asyncio.sleep(PRESENCE_HEARTBEAT_INTERVAL)
+
+            try:
+                await cls._refresh(dict(cls._connections))
+
+            # the task is shared by all connections of the process, so it must survive any error
+            except RedisError as e:
+                traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                logger.warning(f"Failed to refresh the presence of connections. More details:\n{traceback_message}")
+
+            except Exception as e:
+                traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                logger.error(f"Failed to refresh the presence of connections. More details:\n{traceback_message}")
@@ -1,36 +1,132 @@
 import asyncio
+import traceback
 from functools import wraps
 from typing import Callable, ParamSpec, Awaitable
 
+from aioredis.client import Pipeline, PubSub
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+
 from main_app.config import logger
-from main_app.database import redis_client
+from main_app.database import redis_client, redis_binary_client
 
 
 Params = ParamSpec("Params")
 
 
 class PubSubService:
+    """
+    All listeners of the process share one redis pub/sub connection. A channel is subscribed to while it has at least
+    one local listener, and every received message is put into the queues of the channel's listeners, so the number
+    of redis connections does not depend on the number of websockets.
+
+    Messages are received as bytes, since payloads may be encoded with a binary codec.
+    """
+
+    _pubsub: PubSub | None = None
+    _listeners: dict[str, set[asyncio.Queue[bytes]]] = {}
+    _dispatch_task: asyncio.Task | None = None
+    _lock = asyncio.Lock()
+
     @classmethod
-    async def send(cls, channel_name: str, message: str) -> None:
-        await redis_client.publish(channel_name, message)
+    async def send(cls, channel_name: str, message: str | bytes, pipe: Pipeline | None = None) -> None:
+        """
+        :param pipe: If passed, the command is only queued in this pipeline and the caller executes it.
+        """
+
+        if pipe is None:
+            await redis_client.publish(channel_name, message)
+        else:
+            pipe.publish(channel_name, message)
 
     @classmethod
-    def listen(cls, func: Callable[[Params.args, str, Params.kwargs], Awaitable[None]]) -> Callable[
-        [Params.args, str, Params.kwargs],
+    async def subscribe(cls, channel_name: str) -> asyncio.Queue[bytes]:
+        queue = asyncio.Queue()
+
+        async with cls._lock:
+            listeners = cls._listeners.setdefault(channel_name, set())
+            listeners.add(queue)
+
+            if len(listeners) == 1:
+                if cls._pubsub is None:
+                    cls._pubsub = redis_binary_client.pubsub()
+
+                try:
+                    await cls._pubsub.subscribe(channel_name)
+
+                except Exception:
+                    # otherwise the channel would be considered subscribed to by the next listeners
+                    cls._listeners.pop(channel_name, None)
+                    raise
+
+            if cls._dispatch_task is None or cls._dispatch_task.done():
+                cls._dispatch_task = asyncio.create_task(cls._dispatch())
+
+        return queue
+
+    @classmethod
+    async def unsubscribe(cls, channel_name: str, queue: asyncio.Queue[bytes]) -> None:
+        async with cls._lock:
+            listeners = cls._listeners.get(channel_name, set())
+            listeners.discard(queue)
+
+            if not listeners:
+                cls._listeners.pop(channel_name, None)
+                await cls._pubsub.unsubscribe(channel_name)
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._dispatch_task:
+            cls._dispatch_task.cancel()
+
+        if cls._pubsub:
+            await cls._pubsub.reset()
+
+    @classmethod
+    async def _dispatch(cls) -> None:
+        while True:
+            try:
+                message = await cls._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+
+            except RedisConnectionError as e:
+                traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                logger.warning(f"Redis pubsub connection error. More details:\n{traceback_message}")
+
+                # the connection is restored and resubscribed on the next read
+                await asyncio.sleep(1)
+                continue
+
+            if message and message["type"] == "message":
+                for queue in cls._listeners.get(message["channel"].decode(), ()):
+                    queue.put_nowait(message["data"])
+
+    @classmethod
+    def listen(cls, func: Callable[[Params.args, bytes, Params.kwargs], Awaitable[None]]) -> Callable[
+        [Params.args, bytes, Params.kwargs],
         Awaitable[None]
     ]:
         @wraps(func)
         async def wrapper(*args: Params.args, channel_name: str, **kwargs: Params.kwargs) -> None:
-            async with redis_client.pubsub() as channel:
-                await channel.subscribe(channel_name)
+            queue = None
+            try:
+                # the listener waits for redis instead of failing, if it is not available yet
+                while queue is None:
+                    try:
+                        queue = await cls.subscribe(channel_name)
+
+                    except RedisConnectionError as e:
+                        logger.warning(f"Failed to subscribe to '{channel_name}' pubsub: {e}")
+                        await asyncio.sleep(1)
+
                 logger.info(f"Start listening '{channel_name}' pubsub...")
-                try:
-                    async for message in channel.listen():
-                        if message["type"] == "message":
-                            await func(*args, message['data'], **kwargs)
+                while True:
+                    message = await queue.get()
+                    await func(*args, message, **kwargs)
+
+            except asyncio.CancelledError:
+                logger.info(f"Stop listening '{channel_name}' pubsub.")
 
-                except asyncio.CancelledError:
-                    await channel.unsubscribe(channel_name)
-                    logger.info(f"Stop listening '{channel_name}' pubsub.")
+            finally:
+                if queue is not None:
+                    await cls.unsubscribe(channel_name, queue)
 
         return wrapper
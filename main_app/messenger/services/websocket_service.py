@@ -1,86 +1,277 @@
-import json
+import asyncio
 import traceback
+from collections import deque
 
-from fastapi.encoders import jsonable_encoder
-from fastapi.websockets import WebSocket
+from fastapi.websockets import WebSocket, WebSocketDisconnect
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncSession
 from aioredis.exceptions import ConnectionError as RedisConnectionError
 
-from main_app.config import logger
-from main_app.database import redis_client
-from main_app.messenger.constants import MESSAGES_CACHE_KEY_TEMPLATE, SESSIONS_COUNT_KEY_TEMPLATE
-from main_app.messenger.schemas import MessageRead, MessageCreate
+from main_app import codec, serialization
+from main_app.auth.services.user_service import UserService
+from main_app.config import settings, logger
+from main_app.database import redis_client, async_sessionmaker_instance
+from main_app.messenger.constants import (
+    CHAT_PUBSUB_NAME_TEMPLATE,
+    USER_PUBSUB_NAME_TEMPLATE,
+    CONVERSATION_ID_TEMPLATE,
+    WEBSOCKET_RESYNC_CLOSE_CODE,
+    WEBSOCKET_RESYNC_CLOSE_REASON
+)
+from main_app.messenger.schemas import MessageRead, MessageCreate, MessageEvent
+from main_app.messenger.services.ingest_service import message_ingest_service
 from main_app.messenger.services.message_service import MessageService
+from main_app.messenger.services.notification_service import NotificationService
+from main_app.messenger.services.presence_service import PresenceService
 from main_app.messenger.services.pubsub_service import PubSubService
 from main_app.messenger.tasks import send_notification
 
 
 class WebsocketService:
-    def __init__(self, websocket: WebSocket):
+    """
+    Outgoing frames are put into a bounded queue and sent by a separate writer task, so a slow client doesn't
+    block receiving messages from pub/sub. When the queue is full, the policy from the settings is applied.
+    """
+
+    _counters = {"connections": 0, "coalesced_frames": 0, "dropped_frames": 0, "slow_consumers_disconnected": 0}
+
+    def __init__(self, websocket: WebSocket, coalesce_frames: bool = False):
+        """
+        :param coalesce_frames: If True, all frames waiting in the queue are sent at once as one frame with
+            a JSON array, so the client must accept both single events and arrays of them.
+        """
+
         self.websocket = websocket
+        self.coalesce_frames = coalesce_frames
+
+        self._pending_tasks: set[asyncio.Task] = set()
+        self._outbound: deque[bytes] = deque()
+        self._has_outbound = asyncio.Event()
+        self._must_resync = False
+        self._writer_task: asyncio.Task | None = None
 
     async def connect(self) -> None:
         await self.websocket.accept()
 
-    async def listen(
-            self,
-            session: AsyncSession,
-            sender_id: int,
-            channel_name: str,
-            session_marker: bool = False
-    ) -> None:
-        async for new_message in self.websocket.iter_json():
+        self._writer_task = asyncio.create_task(self._write_forever())
+        self._counters["connections"] += 1
+
+    async def disconnect(self) -> None:
+        if self._writer_task:
+            self._writer_task.cancel()
+            self._counters["connections"] -= 1
+
+    def send(self, frame: bytes) -> None:
+        """
+        Puts a JSON frame into the queue of the socket without waiting for it to be sent.
+        """
+
+        if self._must_resync:
+            return
+
+        if len(self._outbound) >= settings.WEBSOCKET_OUTBOUND_QUEUE_SIZE:
+            if settings.WEBSOCKET_SLOW_CONSUMER_POLICY == "drop_oldest":
+                self._outbound.popleft()
+                self._counters["dropped_frames"] += 1
+
+            else:
+                # the queued frames are useless, since the client reloads the history after reconnecting
+                self._outbound.clear()
+                self._must_resync = True
+                self._has_outbound.set()
+                self._counters["slow_consumers_disconnected"] += 1
+
+                return
+
+        self._outbound.append(frame)
+        self._has_outbound.set()
+
+    @classmethod
+    def get_metrics(cls) -> dict[str, int]:
+        return dict(cls._counters)
+
+    async def listen(self, sender_id: int, session_marker: bool = False) -> None:
+        """
+        A database session is opened only to store a message and closed right after that, so idle sockets don't
+        hold connections of the pool.
+        """
+
+        async for raw_message in self.websocket.iter_text():
             if not session_marker:
+                new_message = serialization.loads(raw_message)
+                validated_message = None
+                is_stored = None
                 try:
                     new_message["sender_id"] = sender_id
-                    message_instance = await MessageService.create(session, MessageCreate.model_validate(new_message))
-
-                    validated_message = MessageRead.model_validate(message_instance)
-
-                    sender_cache_key = MESSAGES_CACHE_KEY_TEMPLATE.format(
-                        sender_id=sender_id,
-                        recipient_id=validated_message.recipient_id
-                    )
-                    recipient_cache_key = MESSAGES_CACHE_KEY_TEMPLATE.format(
-                        sender_id=validated_message.recipient_id,
-                        recipient_id=sender_id
-                    )
-                    await MessageService.add_new_message_to_cache(
-                        validated_message,
-                        sender_cache_key,
-                        recipient_cache_key
-                    )
-
-                    json_valid_message = jsonable_encoder(validated_message)
-                    json_valid_message["status"] = "OK"
-                    await PubSubService.send(channel_name, json.dumps(json_valid_message))
-
-                    recipient_sessions_count_redis_key = SESSIONS_COUNT_KEY_TEMPLATE.format(
-                        id=validated_message.recipient_id
-                    )
-                    recipient_is_online = await redis_client.exists(recipient_sessions_count_redis_key)
+                    values = MessageCreate.model_validate(new_message)
+
+                    if message_ingest_service.is_running:
+                        validated_message, is_stored = await message_ingest_service.put(values)
+                    else:
+                        async with async_sessionmaker_instance(info={"user_id": sender_id}) as session:
+                            message_instance = await MessageService.create(session, values)
+                        validated_message = MessageRead.model_validate(message_instance)
+
+                    cache_key = MessageService.get_cache_key(sender_id, validated_message.recipient_id)
+                    recipient_is_online = await self.publish_new_message(validated_message, cache_key)
+
+                    if is_stored:
+                        self._run_in_background(self._report_if_not_stored(validated_message, is_stored, cache_key))
+
+                    # the message is already delivered, so a failed notification must not be reported as
+                    # a failed message
                     if not recipient_is_online:
-                        send_notification.delay(validated_message.recipient_id, sender_id)
+                        try:
+                            await self.schedule_notification(validated_message.recipient_id, sender_id)
+
+                        except Exception as e:
+                            traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                            logger.error(f"Failed to schedule a notification about message with ID "
+                                         f"{validated_message.id}. More details:\n{traceback_message}")
 
                 except SQLAlchemyError as e:
                     traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
                     logger.warning(f"Details:\n{traceback_message}")
 
-                    await session.rollback()
-
                     new_message["status"] = "error"
-                    await self.websocket.send_json(new_message)
+                    self.send(serialization.dumps(new_message))
 
                 except RedisConnectionError as e:
                     traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
                     logger.warning(f"Redis connection error. More details:\n{traceback_message}")
 
-                    await MessageService.delete(session, message_instance)
+                    if is_stored:
+                        is_stored.cancel()
+                    elif validated_message:
+                        async with async_sessionmaker_instance() as session:
+                            await MessageService.delete_by_pk(session, validated_message.id)
 
                     new_message["status"] = "error"
-                    await self.websocket.send_json(new_message)
+                    self.send(serialization.dumps(new_message))
+
+    @staticmethod
+    async def publish_new_message(message: MessageRead, cache_key: str) -> bool:
+        """
+        Adds the message to the cache, publishes it and checks whether the recipient is online in a single
+        round-trip to redis.
+
+        The message is published to the channels of both users, which are listened to by the multiplexed sockets,
+        and to the channel of the conversation, which is listened to by the sockets opened for a single chat.
+
+        :return: True if the recipient is online.
+        """
+
+        min_user_id = min(message.sender_id, message.recipient_id)
+        max_user_id = max(message.sender_id, message.recipient_id)
+
+        payload = codec.encode(MessageEvent(
+            **message.model_dump(),
+            conversation_id=CONVERSATION_ID_TEMPLATE.format(min_user_id=min_user_id, max_user_id=max_user_id)
+        ))
+
+        channel_names = {
+            CHAT_PUBSUB_NAME_TEMPLATE.format(min_user_id=min_user_id, max_user_id=max_user_id),
+            USER_PUBSUB_NAME_TEMPLATE.format(user_id=message.sender_id),
+            USER_PUBSUB_NAME_TEMPLATE.format(user_id=message.recipient_id)
+        }
+
+        async with redis_client.pipeline(transaction=True) as pipe:
+            await MessageService.add_new_message_to_cache(message, cache_key, pipe)
+            for channel_name in channel_names:
+                await PubSubService.send(channel_name, payload, pipe)
+            await PresenceService.is_online(message.recipient_id, pipe)
+
+            *_, recipient_connections_count = await pipe.execute()
+
+        return recipient_connections_count > 0
+
+    @staticmethod
+    async def schedule_notification(recipient_id: int, sender_id: int) -> None:
+        """
+        Only the first message of an aggregation window schedules a notification, the next ones are added to it.
+        The task gets everything it needs to send the notification, so it does not access the database.
+        """
+
+        async with async_sessionmaker_instance() as session:
+            profiles = await UserService.get_profiles(session, [recipient_id, sender_id])
+
+        recipient = profiles.get(recipient_id)
+        # users without a linked telegram account can't be notified
+        if not recipient or not recipient.telegram_id:
+            return
+
+        sender = profiles.get(sender_id)
+        if not sender:
+            logger.warning(f"Notification is not sent, because the sender with ID {sender_id} does not exist.")
+            return
+
+        if await NotificationService.add_pending(recipient_id, sender_id, sender.full_name):
+            send_notification.apply_async(
+                (recipient_id, recipient.telegram_id),
+                countdown=settings.NOTIFICATIONS_AGGREGATION_WINDOW
+            )
+
+    async def _report_if_not_stored(self, message: MessageRead, is_stored: asyncio.Future, cache_key: str) -> None:
+        """
+        With the write-behind persistence a message is published before it is stored. If storing fails,
+        the message is removed from the cache and the sender gets it back with the error status.
+        """
+
+        try:
+            await is_stored
+
+        except asyncio.CancelledError:
+            return
+
+        except Exception as e:
+            traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+            logger.warning(f"Message with ID {message.id} has not been stored. More details:\n{traceback_message}")
+
+            try:
+                await MessageService.remove_from_cache(message.id, cache_key)
+
+                self.send(serialization.dumps(MessageEvent(**message.model_dump(), status="error")))
+
+            except RedisConnectionError as e:
+                logger.warning(f"Failed to report that message with ID {message.id} has not been stored: {e}")
+
+    def _run_in_background(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+
+        # a reference is kept until the task is done, otherwise it can be garbage collected
+        self._pending_tasks.add(task)
+        task.add_done_callback(self._pending_tasks.discard)
+
+    async def _write_forever(self) -> None:
+        while True:
+            await self._has_outbound.wait()
+
+            if self._must_resync:
+                logger.warning("Websocket of a slow client is closed, its outgoing queue is full.")
+                await self.websocket.close(code=WEBSOCKET_RESYNC_CLOSE_CODE, reason=WEBSOCKET_RESYNC_CLOSE_REASON)
+
+                return
+
+            if self.coalesce_frames and len(self._outbound) > 1:
+                frames = list(self._outbound)
+                self._outbound.clear()
+
+                frame = b"[" + b",".join(frames) + b"]"
+                self._counters["coalesced_frames"] += len(frames)
+
+            else:
+                frame = self._outbound.popleft()
+
+            if not self._outbound:
+                self._has_outbound.clear()
+
+            try:
+                await self.websocket.send_text(frame.decode())
+
+            except (WebSocketDisconnect, RuntimeError) as e:
+                logger.info(f"Websocket is closed while sending a frame: {e}")
+
+                return
 
     @PubSubService.listen
-    async def handle_messages_from_pubsub(self, message: str):
-        await self.websocket.send_text(message)
+    async def handle_messages_from_pubsub(self, message: bytes):
+        self.send(codec.to_json(message))
@@ -1,30 +1,112 @@
-import asyncio
+from datetime import datetime, timedelta
 
 import httpx
 
 from main_app.auth.services.user_service import UserService
-from main_app.config import celery_manager, settings
-from main_app.database import async_sessionmaker_instance, async_engine
+from main_app.config import celery_manager, settings, logger
+from main_app.database import async_engine, async_sessionmaker_instance
+from main_app.messenger.constants import NOTIFICATIONS_MAX_SENDERS_NAMES
+from main_app.messenger.services.notification_service import NotificationService
+from main_app.messenger.services.partition_service import MessagePartitionService
+from main_app.worker import AsyncWorker
 
 
-@celery_manager.task
-def send_notification(recipient_id: int, sender_id: int) -> None:
-    async def notify():
-        await async_engine.dispose(close=False)
-
-        async with async_sessionmaker_instance() as session:
-            recipient = await UserService.get_by_pk(session, recipient_id)
-            telegram_id = recipient.telegram_id
-
-            if telegram_id:
-                sender = await UserService.get_by_pk(session, sender_id)
-                sender_full_name = f"{sender.first_name} {sender.last_name}"
-
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        f"http://{settings.NOTIFICATION_SERVICE_HOST}:{settings.NOTIFICATION_SERVICE_PORT}/notify/",
-                        params={"telegram_id": telegram_id, "sender_full_name": sender_full_name}
+@celery_manager.task(bind=True, max_retries=settings.NOTIFICATIONS_DELIVERY_MAX_RETRIES)
+def send_notification(self, recipient_id: int, telegram_id: int | None = None) -> None:
+    """
+    Sends one notification about all messages that the recipient has received since the previous one.
+    The pending messages are removed only after the notification service has accepted the notification, and
+    if its backlog is full or it is unavailable, the task is retried.
+
+    :param telegram_id: If it isn't passed, it is taken from the recipient's profile.
+    """
+
+    async def notify() -> int | None:
+        """
+        :return: The delay of the retry in seconds or None if the task is done.
+        """
+
+        pending_messages = await NotificationService.get_pending(recipient_id)
+        if not pending_messages:
+            return None
+
+        chat_id = telegram_id
+        if chat_id is None:
+            async with async_sessionmaker_instance() as session:
+                recipient = await UserService.get_profile(session, recipient_id)
+
+            if not recipient or not recipient.telegram_id:
+                await NotificationService.acknowledge(recipient_id, pending_messages)
+
+                return None
+
+            chat_id = recipient.telegram_id
+
+        senders = sorted(
+            NotificationService.group_by_senders(pending_messages).values(),
+            key=lambda sender: sender[1],
+            reverse=True
+        )
+
+        try:
+            response = await AsyncWorker.http_client.post(
+                f"http://{settings.NOTIFICATION_SERVICE_HOST}:{settings.NOTIFICATION_SERVICE_PORT}/notify/",
+                params={
+                    "telegram_id": chat_id,
+                    "sender_full_names": [
+                        sender_full_name for sender_full_name, _ in senders[:NOTIFICATIONS_MAX_SENDERS_NAMES]
+                    ],
+                    "senders_count": len(senders),
+                    "messages_count": sum(count for _, count in senders)
+                }
+            )
+
+        except httpx.TransportError as e:
+            logger.warning(f"Notification service is unavailable: {e}")
+
+            retry_delay = settings.NOTIFICATIONS_DELIVERY_RETRY_DELAY
+
+        else:
+            if response.status_code != 503:
+                response.raise_for_status()
+
+                if await NotificationService.acknowledge(recipient_id, pending_messages):
+                    send_notification.apply_async(
+                        (recipient_id, chat_id),
+                        countdown=settings.NOTIFICATIONS_AGGREGATION_WINDOW
                     )
-                    response.raise_for_status()
 
-    asyncio.run(notify())
+                return None
+
+            # the backlog of the notification service is full
+            retry_after = response.headers.get("Retry-After", "")
+            retry_delay = int(retry_after) if retry_after.isdigit() else settings.NOTIFICATIONS_DELIVERY_RETRY_DELAY
+
+        await NotificationService.postpone(recipient_id, retry_delay)
+
+        return retry_delay
+
+    retry_delay = AsyncWorker.run(notify)
+    if retry_delay is not None:
+        raise self.retry(countdown=retry_delay)
+
+
+@celery_manager.task
+def maintain_message_partitions() -> None:
+    """
+    Creates the next partitions of messages in advance and moves the old ones to the archive if it is enabled.
+    """
+
+    async def maintain():
+        async with async_engine.connect() as connection:
+            connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+
+            await MessagePartitionService.create_partitions_ahead(connection)
+
+            if settings.MESSAGES_ARCHIVE_AFTER_DAYS is not None:
+                await MessagePartitionService.archive_partitions(
+                    connection,
+                    datetime.utcnow() - timedelta(days=settings.MESSAGES_ARCHIVE_AFTER_DAYS)
+                )
+
+    AsyncWorker.run(maintain)
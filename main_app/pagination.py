@@ -1,6 +1,115 @@
-from pydantic import BaseModel, Field
+import base64
+import json
+from typing import Any, TypeVar
+
+from pydantic import BaseModel, Field, ValidationError, model_validator
+
+from main_app.exceptions import InvalidCursorError
+
+
+Pagination = TypeVar("Pagination", bound=BaseModel)
 
 
 class DefaultPagination(BaseModel):
     limit: int = Field(5, gt=0, le=100)
     offset: int = Field(0, ge=0)
+
+
+class CursorPagination(BaseModel):
+    """
+    Keyset pagination by the primary key. "before_id" requests the page of records that precede the specified one
+    (scrolling back through the history), "after_id" requests the page of records that follow it. If none of them
+    is specified, the latest page is requested.
+    """
+
+    limit: int = Field(5, gt=0, le=100)
+    before_id: int | None = Field(None, gt=0)
+    after_id: int | None = Field(None, ge=0)
+
+    @model_validator(mode="after")
+    def check_direction(self) -> "CursorPagination":
+        if self.before_id is not None and self.after_id is not None:
+            raise ValueError("'before_id' can not be combined with 'after_id'.")
+
+        return self
+
+    @property
+    def is_backward(self) -> bool:
+        return self.after_id is None
+
+    def get_next_cursor(self, first_id: int, last_id: int) -> str:
+        """
+        Builds an opaque cursor for the page that continues the current one in the same direction.
+
+        :param first_id: The smallest primary key on the current page.
+        :param last_id: The biggest primary key on the current page.
+        """
+
+        if self.is_backward:
+            return encode_cursor({"before_id": first_id})
+        else:
+            return encode_cursor({"after_id": last_id})
+
+    @classmethod
+    def from_cursor(cls, cursor: str, limit: int) -> "CursorPagination":
+        return decode_cursor(cls, cursor, limit)
+
+
+class KeysetPagination(BaseModel):
+    """
+    Keyset pagination by a sort column with the primary key as a tie-breaker. The page contains records that follow
+    the record with the specified values in the sort order. If they are not specified, the first page is requested.
+
+    The sorting is stored in the cursor, since the position of a record is meaningless for another sorting.
+    """
+
+    limit: int = Field(5, gt=0, le=100)
+    after_value: str | int | None = None
+    after_id: int | None = Field(None, ge=0)
+    sort_by: str | None = None
+    order: str | None = None
+
+    @property
+    def is_first_page(self) -> bool:
+        return self.after_id is None
+
+    def is_issued_for(self, sort_by: str, order: str) -> bool:
+        return self.sort_by == sort_by and self.order == order
+
+    def get_next_cursor(self, last_value: str | int, last_id: int) -> str:
+        """
+        :param last_value: Value of the sort column of the last record on the current page.
+        :param last_id: The primary key of the last record on the current page.
+        """
+
+        values = {"after_value": last_value, "after_id": last_id}
+        if self.sort_by is not None:
+            values.update(sort_by=self.sort_by, order=self.order)
+
+        return encode_cursor(values)
+
+    @classmethod
+    def from_cursor(cls, cursor: str, limit: int) -> "KeysetPagination":
+        return decode_cursor(cls, cursor, limit)
+
+
+class RankedPagination(KeysetPagination):
+    """
+    Keyset pagination of search results ordered by their rank.
+    """
+
+    after_value: float | None = None
+
+
+def encode_cursor(values: dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(pagination_class: type[Pagination], cursor: str, limit: int) -> Pagination:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+        return pagination_class(limit=limit, **values)
+
+    except (ValueError, TypeError, ValidationError):
+        raise InvalidCursorError(cursor)
@@ -0,0 +1,157 @@
+import time
+from typing import Any
+from uuid import uuid4
+
+import aioredis
+from aioredis import BlockingConnectionPool, Connection
+from aioredis.exceptions import ConnectionError as RedisConnectionError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, PoolProxiedConnection
+
+from main_app.config import settings
+
+
+class PoolMetricsMixin:
+    """
+    Counts how long the callers wait for a connection, so a starving pool can be noticed before it turns into
+    the latency of requests.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._waiting = 0
+        self._counters = {"checkouts": 0, "timeouts": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+
+    def connect(self) -> PoolProxiedConnection:
+        self._waiting += 1
+        started_at = time.monotonic()
+        try:
+            connection = super().connect()
+
+        except PoolTimeoutError:
+            self._counters["timeouts"] += 1
+            raise
+
+        finally:
+            self._waiting -= 1
+
+            wait_time = time.monotonic() - started_at
+            self._counters["wait_time_total"] += wait_time
+            self._counters["wait_time_max"] = max(self._counters["wait_time_max"], wait_time)
+
+        self._counters["checkouts"] += 1
+
+        return connection
+
+    def get_stats(self) -> dict[str, Any]:
+        return {**self._counters, "waiting": self._waiting}
+
+
+class MonitoredQueuePool(PoolMetricsMixin, AsyncAdaptedQueuePool):
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            **super().get_stats(),
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0)
+        }
+
+
+class MonitoredNullPool(PoolMetricsMixin, NullPool):
+    pass
+
+
+class MonitoredRedisPool(BlockingConnectionPool):
+    """
+    When all connections are in use, the callers wait for a free one until the timeout instead of failing at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._waiting = 0
+        self._in_use: set[Connection] = set()
+        self._counters = {"checkouts": 0, "timeouts": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+
+    async def get_connection(self, command_name, *keys, **options):
+        self._waiting += 1
+        started_at = time.monotonic()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+
+        except RedisConnectionError:
+            if time.monotonic() - started_at >= self.timeout:
+                self._counters["timeouts"] += 1
+            raise
+
+        finally:
+            self._waiting -= 1
+
+            wait_time = time.monotonic() - started_at
+            self._counters["wait_time_total"] += wait_time
+            self._counters["wait_time_max"] = max(self._counters["wait_time_max"], wait_time)
+
+        self._counters["checkouts"] += 1
+        self._in_use.add(connection)
+
+        return connection
+
+    async def release(self, connection: Connection) -> None:
+        self._in_use.discard(connection)
+
+        await super().release(connection)
+
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            **self._counters,
+            "waiting": self._waiting,
+            "size": self.max_connections,
+            "created": len(self._connections),
+            "checked_out": len(self._in_use)
+        }
+
+
+def get_engine_options() -> dict[str, Any]:
+    """
+    Keyword arguments of "create_async_engine" from the settings.
+    """
+
+    if settings.DB_PGBOUNCER_MODE:
+        # PgBouncer in the transaction mode pools the connections itself and doesn't keep prepared statements
+        # between transactions, so they are not cached and get unique names
+        return {
+            "poolclass": MonitoredNullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__"
+            }
+        }
+
+    return {
+        "poolclass": MonitoredQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_POOL_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "connect_args": {
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE
+        }
+    }
+
+
+def create_redis_client(**kwargs) -> aioredis.Redis:
+    """
+    :param kwargs: Options of the connections, e.g. "decode_responses".
+    """
+
+    connection_pool = MonitoredRedisPool.from_url(
+        settings.redis_connection_url,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        **kwargs
+    )
+
+    return aioredis.Redis(connection_pool=connection_pool)
@@ -0,0 +1,155 @@
+import asyncio
+import random
+import traceback
+from typing import Any
+
+import aioredis
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from main_app.config import logger
+from main_app.pools import get_engine_options
+
+
+PRIMARY_PIN_KEY_TEMPLATE = "database:primary_pin:user_id_{id}"
+
+PRIMARY_WAL_POSITION_QUERY = text("SELECT pg_current_wal_lsn()::text")
+# a replica that has replayed the WAL up to the position of the primary has no lag, otherwise the lag is the time
+# since the last replayed transaction. A server that is not in recovery (e.g. a copy of the database used instead
+# of a replica) has no lag either.
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+            OR pg_last_wal_replay_lsn() >= CAST(CAST(:primary_wal_position AS text) AS pg_lsn) THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+class ReplicaSet:
+    """
+    Read-only replicas of the database. Their lag is checked periodically, and a replica that falls behind more
+    than the limit or doesn't respond is excluded from the rotation until it catches up.
+
+    After a user writes to the primary, the user is pinned to the primary for the read-your-writes window, so
+    their next reads don't go to a replica that hasn't received the write yet.
+    """
+
+    def __init__(
+            self,
+            primary_engine: AsyncEngine,
+            urls: list[str],
+            redis_client: aioredis.Redis,
+            max_lag: float,
+            check_interval: float,
+            read_your_writes_window: float
+    ):
+        self.primary_engine = primary_engine
+        self.redis_client = redis_client
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.read_your_writes_window = read_your_writes_window
+
+        self.engines: dict[str, AsyncEngine] = {}
+        for url in urls:
+            engine = create_async_engine(url, **get_engine_options())
+            self.engines[f"{engine.url.host}:{engine.url.port}"] = engine
+
+        # replicas are not used until their lag is checked
+        self._available: list[AsyncEngine] = []
+        self._lags: dict[str, float | None] = dict.fromkeys(self.engines)
+        self._monitor_task: asyncio.Task | None = None
+
+    @property
+    def is_enabled(self) -> bool:
+        return bool(self.engines)
+
+    def choose(self) -> AsyncEngine | None:
+        """
+        :return: A random replica from the rotation or None if there are no available replicas.
+        """
+
+        if not self._available:
+            return None
+
+        return random.choice(self._available)
+
+    async def pin_to_primary(self, user_id: int) -> None:
+        await self.redis_client.set(
+            PRIMARY_PIN_KEY_TEMPLATE.format(id=user_id),
+            1,
+            px=int(self.read_your_writes_window * 1000)
+        )
+
+    async def is_pinned_to_primary(self, user_id: int) -> bool:
+        return bool(await self.redis_client.exists(PRIMARY_PIN_KEY_TEMPLATE.format(id=user_id)))
+
+    async def start(self) -> None:
+        if self.is_enabled:
+            await self.check_lags()
+            self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def stop(self) -> None:
+        if self._monitor_task:
+            self._monitor_task.cancel()
+
+        for engine in self.engines.values():
+            await engine.dispose()
+
+    async def check_lags(self) -> None:
+        async with self.primary_engine.connect() as connection:
+            primary_wal_position = await connection.scalar(PRIMARY_WAL_POSITION_QUERY)
+
+        available = []
+        for name, engine in self.engines.items():
+            try:
+                lag = await asyncio.wait_for(self._get_lag(engine, primary_wal_position), timeout=self.check_interval)
+
+            except (SQLAlchemyError, OSError, asyncio.TimeoutError) as e:
+                logger.warning(f"Replica '{name}' is unavailable: {e}")
+                lag = None
+
+            self._lags[name] = lag
+
+            if lag is not None and lag <= self.max_lag:
+                available.append(engine)
+                if engine not in self._available:
+                    logger.info(f"Replica '{name}' is added to the rotation.")
+
+            elif engine in self._available:
+                logger.warning(f"Replica '{name}' is removed from the rotation, its lag is {lag} seconds.")
+
+        self._available = available
+
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            name: {
+                "lag": self._lags[name],
+                "available": engine in self._available,
+                "pool": engine.pool.get_stats()
+            }
+            for name, engine in self.engines.items()
+        }
+
+    @staticmethod
+    async def _get_lag(engine: AsyncEngine, primary_wal_position: str) -> float | None:
+        """
+        :return: The lag in seconds or None if it is unknown, e.g. no transactions have been replayed yet.
+        """
+
+        async with engine.connect() as connection:
+            lag = await connection.scalar(REPLICA_LAG_QUERY, {"primary_wal_position": primary_wal_position})
+
+        return None if lag is None else float(lag)
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+
+            try:
+                await self.check_lags()
+
+            except Exception as e:
+                traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                logger.error(f"Failed to check the lag of replicas. More details:\n{traceback_message}")
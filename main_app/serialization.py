@@ -0,0 +1,34 @@
+from typing import Any
+
+import orjson
+from pydantic import BaseModel
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Pydantic models are serialized by pydantic itself, everything else by orjson. Both encode directly to bytes.
+    """
+
+    if isinstance(value, BaseModel):
+        return value.__pydantic_serializer__.to_json(value)
+
+    return orjson.dumps(value, default=_to_jsonable)
+
+
+def dumps_to_str(value: Any) -> str:
+    """
+    For text websocket frames.
+    """
+
+    return dumps(value).decode()
+
+
+def loads(data: str | bytes) -> Any:
+    return orjson.loads(data)
+
+
+def _to_jsonable(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -1,7 +1,8 @@
-from typing import TypeVar, Generic, Any
+from contextlib import contextmanager
+from typing import TypeVar, Generic, Any, Iterator
 
 from pydantic import BaseModel
-from sqlalchemy import select, inspect, update, delete
+from sqlalchemy import select, inspect, insert, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from main_app.exceptions import CompositePrimaryKeyError
@@ -20,6 +21,24 @@ class BaseDAO(Generic[Model, ModelCreateSchema, ModelUpdateSchema]):
         super().__init_subclass__(**kwargs)
         cls.model = model
 
+    @staticmethod
+    @contextmanager
+    def reading_from_primary(session: AsyncSession, enabled: bool = True) -> Iterator[None]:
+        """
+        Reads inside the block go to the primary even if the session routes them to the replicas, e.g. when
+        the result is cached, so data of a lagging replica doesn't get into the cache.
+        """
+
+        use_replica = session.info.get("use_replica", False)
+        if enabled:
+            session.info["use_replica"] = False
+
+        try:
+            yield
+
+        finally:
+            session.info["use_replica"] = use_replica
+
     @classmethod
     async def get_all(cls, session: AsyncSession) -> list[Model]:
         result = await session.scalars(select(cls.model))
@@ -42,6 +61,19 @@ class BaseDAO(Generic[Model, ModelCreateSchema, ModelUpdateSchema]):
 
         return instance
 
+    @classmethod
+    async def bulk_create(cls, session: AsyncSession, values: list[dict[str, Any]], do_commit: bool = True) -> None:
+        """
+        Inserts all rows with a single executemany statement, which SQLAlchemy sends as multi-row INSERTs.
+        Instances are not created, so the rows must already contain everything that the caller needs
+        (e.g. primary keys allocated in advance).
+        """
+
+        await session.execute(insert(cls.model), values)
+
+        if do_commit:
+            await session.commit()
+
     @classmethod
     async def update(cls, session: AsyncSession, pk: Any, values: ModelUpdateSchema, do_commit: bool = True) -> None:
         """
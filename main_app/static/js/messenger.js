@@ -10,13 +10,16 @@ const loadMore = document.getElementById('loadMore');
 
 let selectedUserId = null;
 let selectedUserName = null;
-let websocketConnectionWithSelectedUser = null;
+let websocketConnection = null;
 let messagePollingInterval = null;
 let messagesLimit = 20;
 let countUploadedMessages = 0;
+let nextMessagesCursor = null;
 let isLoadingMessages = false;
 let hasMoreMessages = true;
 
+const WEBSOCKET_RESYNC_CLOSE_CODE = 4000;
+
 
 function createMessageElement(message, userName) {
     let messageContainer = document.createElement('div');
@@ -47,12 +50,16 @@ function createMessageElement(message, userName) {
     return messageContainer;
 }
 
-async function loadMessages(userId, userName, limit, offset) {
+async function loadMessages(userId, userName, limit, cursor) {
     try {
-        let response = await fetch(`/messenger/messages/${userId}?limit=${limit}&offset=${offset}`);
+        let url = `/messenger/messages/${userId}?limit=${limit}`;
+        if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+
+        let response = await fetch(url);
         let messages = await response.json();
+        nextMessagesCursor = response.headers.get('X-Next-Cursor');
 
-        if (messages) {
+        if (messages && messages.length) {
             countUploadedMessages += messages.length;
             return messages;
         }
@@ -71,7 +78,7 @@ function sendMessage() {
     if (message && selectedUserId) {
         let payload = {'recipient_id': selectedUserId, 'text_content': message};
         try {
-            websocketConnectionWithSelectedUser.send(JSON.stringify(payload));
+            websocketConnection.send(JSON.stringify(payload));
             messageInput.value = '';
 
         } catch (error) {
@@ -81,35 +88,50 @@ function sendMessage() {
 }
 
 
-function connectWebSocketWithSelectedUser() {
-    if (websocketConnectionWithSelectedUser) websocketConnectionWithSelectedUser.close();
+function getConversationPeerId(message) {
+    return message.sender_id == currentUserId ? message.recipient_id : message.sender_id;
+}
 
-    websocketConnectionWithSelectedUser = new WebSocket(`ws://${window.location.host}/messenger/ws?recipient_id=${selectedUserId}&current_user_id=${currentUserId}`);
+// одно соединение на все чаты пользователя, оно же отмечает пользователя как online
+function connectWebSocket() {
+    websocketConnection = new WebSocket(`ws://${window.location.host}/messenger/ws`);
 
-    websocketConnectionWithSelectedUser.onopen = () => console.log('WebSocket соединение с выбранным пользователем установлено');
+    websocketConnection.onopen = () => console.log('WebSocket соединение установлено');
 
-    websocketConnectionWithSelectedUser.onmessage = (event) => {
-        let incomingMessage = JSON.parse(event.data);
-        countUploadedMessages += 1;
+    websocketConnection.onmessage = (event) => {
+        let data = JSON.parse(event.data);
 
-        chatMessages.appendChild(createMessageElement(incomingMessage, selectedUserName));
-        chatMessages.scrollTop = chatMessages.scrollHeight;
+        // накопившиеся на сервере сообщения приходят одним массивом
+        for (let incomingMessage of Array.isArray(data) ? data : [data]) {
+            handleIncomingMessage(incomingMessage);
+        }
     };
 
-    websocketConnectionWithSelectedUser.onclose = () => console.log('WebSocket соединение с пользователем закрыто');
-}
+    websocketConnection.onclose = (event) => {
+        console.log('WebSocket соединение закрыто, переподключение...');
+        setTimeout(() => {
+            connectWebSocket();
 
-function connectSessionWebSocket() {
-    let sessionWebsocketId = 0;
-    let sessionWebsocket = new WebSocket(`ws://${window.location.host}/messenger/ws?session_marker=True&recipient_id=${sessionWebsocketId}&current_user_id=${currentUserId}`);
+            // сервер закрывает соединение с медленным клиентом, часть сообщений могла быть пропущена
+            if (event.code === WEBSOCKET_RESYNC_CLOSE_CODE && selectedUserId) {
+                selectUser(selectedUserId, selectedUserName);
+            }
+        }, 3000);
+    };
+}
 
-    sessionWebsocket.onopen = () => console.log('WebSocket соединение для отслеживания состояния сессии установлено');
+function handleIncomingMessage(incomingMessage) {
+    let peerId = getConversationPeerId(incomingMessage);
 
-    sessionWebsocket.onmessage = (event) => {
-        // pass
-    };
+    if (peerId == selectedUserId) {
+        countUploadedMessages += 1;
 
-    sessionWebsocket.onclose = () => console.log('WebSocket соединение для отслеживания состояния сессии закрыто');
+        chatMessages.appendChild(createMessageElement(incomingMessage, selectedUserName));
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    } else {
+        let userItem = document.querySelector(`.user-item[data-user-id="${peerId}"]`);
+        if (userItem) userItem.classList.add('unread');
+    }
 }
 
 
@@ -118,7 +140,7 @@ async function handleScroll() {
         isLoadingMessages = true;
         const oldScrollHeight = chatMessages.scrollHeight;
 
-        let messages = await loadMessages(selectedUserId, selectedUserName, messagesLimit, countUploadedMessages);
+        let messages = await loadMessages(selectedUserId, selectedUserName, messagesLimit, nextMessagesCursor);
 
         if (messages) {
             const fragment = document.createDocumentFragment();
@@ -128,7 +150,9 @@ async function handleScroll() {
 
             chatMessages.insertBefore(fragment, chatMessages.firstChild);
             chatMessages.scrollTop = chatMessages.scrollHeight - oldScrollHeight;
-        } else {
+        }
+
+        if (!nextMessagesCursor) {
             hasMoreMessages = false;
             removeScrollHandler();
         }
@@ -152,24 +176,25 @@ async function selectUser(userId, userName) {
     selectedUserId = userId;
     selectedUserName = userName;
     countUploadedMessages = 0;
+    nextMessagesCursor = null;
+    hasMoreMessages = true;
 
     chatTitle.textContent = `Чат с ${selectedUserName}`;
     document.querySelectorAll('.user-item').forEach(item => item.classList.remove('active'));
     document.querySelector(`.user-item[data-user-id="${selectedUserId}"]`).classList.add('active');
+    document.querySelector(`.user-item[data-user-id="${selectedUserId}"]`).classList.remove('unread');
 
     chatMessages.innerHTML = '';
     chatArea.classList.remove('hidden');
 
-    let messages = await loadMessages(selectedUserId, selectedUserName, messagesLimit, countUploadedMessages);
+    let messages = await loadMessages(selectedUserId, selectedUserName, messagesLimit, null);
 
-    for (let message of messages) {
+    for (let message of messages || []) {
         chatMessages.appendChild(createMessageElement(message, selectedUserName));
     }
     chatMessages.scrollTop = chatMessages.scrollHeight;
 
-    attachScrollHandler();
-
-    connectWebSocketWithSelectedUser();
+    if (nextMessagesCursor) attachScrollHandler();
 }
 
 
@@ -219,16 +244,19 @@ logoutBtn.addEventListener('click', async () => {
 
 
 loadMore.addEventListener('click', async () => {
-    let response = await fetch(`/users?offset=${loaded_users_count}`);
-    let newUsers = await response.json();
-    if (newUsers.length === 0) {
-        loadMore.classList.add('hidden');
-    } else {
+    if (nextUsersCursor) {
+        let response = await fetch(`/users?cursor=${encodeURIComponent(nextUsersCursor)}`);
+        let newUsers = await response.json();
+
         addUsersToList(newUsers);
+        nextUsersCursor = response.headers.get('X-Next-Cursor');
+    }
 
-        loaded_users_count += newUsers.length;
+    // курсор следующей страницы не возвращается, если пользователей больше нет
+    if (!nextUsersCursor) {
+        loadMore.classList.add('hidden');
     }
 });
 
 
-connectSessionWebSocket();
+connectWebSocket();
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+from celery.signals import worker_process_init, worker_process_shutdown
+
+from main_app.config import settings, logger
+from main_app.database import async_engine, redis_client
+
+
+Result = TypeVar("Result")
+
+
+class AsyncWorker:
+    """
+    Runs coroutines of celery tasks. If the persistent event loop is enabled, every worker process keeps one event
+    loop in a background thread, so the DB pool, the redis pool and the HTTP client are created once at the worker
+    start and reused by all tasks of the process. Otherwise every task runs in a new event loop and the pools are
+    closed after it.
+    """
+
+    http_client: httpx.AsyncClient | None = None
+
+    _loop: asyncio.AbstractEventLoop | None = None
+    _thread: threading.Thread | None = None
+
+    @classmethod
+    def start(cls) -> None:
+        cls._loop = asyncio.new_event_loop()
+        cls._thread = threading.Thread(target=cls._loop.run_forever, name="async-worker", daemon=True)
+        cls._thread.start()
+
+        cls._submit(cls._open_http_client()).result()
+
+        logger.info("Persistent event loop of the worker has started.")
+
+    @classmethod
+    def stop(cls) -> None:
+        if cls._loop is None:
+            return
+
+        cls._submit(cls._close_connections()).result()
+
+        cls._loop.call_soon_threadsafe(cls._loop.stop)
+        cls._thread.join()
+        cls._loop.close()
+        cls._loop = None
+
+        logger.info("Persistent event loop of the worker has stopped.")
+
+    @classmethod
+    def run(cls, coroutine_function: Callable[[], Awaitable[Result]]) -> Result:
+        """
+        Runs the coroutine and blocks the calling thread until it is done.
+        """
+
+        if cls._loop is not None:
+            return cls._submit(coroutine_function()).result()
+
+        async def run_once() -> Result:
+            await cls._open_http_client()
+            try:
+                return await coroutine_function()
+            finally:
+                await cls._close_connections()
+
+        return asyncio.run(run_once())
+
+    @classmethod
+    def _submit(cls, coroutine: Awaitable[Result]) -> Future[Result]:
+        return asyncio.run_coroutine_threadsafe(coroutine, cls._loop)
+
+    @classmethod
+    async def _open_http_client(cls) -> None:
+        cls.http_client = httpx.AsyncClient()
+
+    @classmethod
+    async def _close_connections(cls) -> None:
+        await cls.http_client.aclose()
+        await redis_client.connection_pool.disconnect()
+        await async_engine.dispose()
+
+
+@worker_process_init.connect
+def start_async_worker(**kwargs) -> None:
+    if settings.CELERY_PERSISTENT_EVENT_LOOP:
+        # connections inherited from the parent process can't be used by the worker process
+        async_engine.sync_engine.dispose(close=False)
+
+        AsyncWorker.start()
+
+
+@worker_process_shutdown.connect
+def stop_async_worker(**kwargs) -> None:
+    AsyncWorker.stop()
@@ -0,0 +1,79 @@
+"""message conversation key
+
+Revision ID: 1947cd4556e3
+Revises: 8a460473f2f7
+Create Date: 2026-10-17 12:05:41.318204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "1947cd4556e3"
+down_revision: Union[str, None] = "8a460473f2f7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade() -> None:
+    op.add_column(
+        "message", sa.Column("min_user_id", sa.Integer(), nullable=True)
+    )
+    op.add_column(
+        "message", sa.Column("max_user_id", sa.Integer(), nullable=True)
+    )
+
+    # every batch is committed separately, so the table is never locked
+    # for the whole backfill
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        max_id = conn.execute(
+            sa.text("SELECT coalesce(max(id), 0) FROM message")
+        ).scalar()
+
+        for first_id in range(0, max_id, BACKFILL_BATCH_SIZE):
+            conn.execute(
+                sa.text(
+                    "UPDATE message "
+                    "SET min_user_id = LEAST(sender_id, recipient_id), "
+                    "max_user_id = GREATEST(sender_id, recipient_id) "
+                    "WHERE id > :first_id AND id <= :last_id"
+                ),
+                {
+                    "first_id": first_id,
+                    "last_id": first_id + BACKFILL_BATCH_SIZE,
+                },
+            )
+
+        op.create_index(
+            "ix_message_conversation",
+            "message",
+            ["min_user_id", "max_user_id", sa.text("id DESC")],
+            postgresql_concurrently=True,
+        )
+
+    # messages that were sent while the backfill was running
+    op.execute(
+        "UPDATE message "
+        "SET min_user_id = LEAST(sender_id, recipient_id), "
+        "max_user_id = GREATEST(sender_id, recipient_id) "
+        "WHERE min_user_id IS NULL"
+    )
+    op.alter_column(
+        "message", "min_user_id", existing_type=sa.Integer(), nullable=False
+    )
+    op.alter_column(
+        "message", "max_user_id", existing_type=sa.Integer(), nullable=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_message_conversation", table_name="message")
+    op.drop_column("message", "max_user_id")
+    op.drop_column("message", "min_user_id")
@@ -0,0 +1,40 @@
+"""user sorting indexes
+
+Revision ID: 5b0c7e21d9a4
+Revises: 1947cd4556e3
+Create Date: 2026-10-17 13:40:12.502871
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5b0c7e21d9a4"
+down_revision: Union[str, None] = "1947cd4556e3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the table is not locked for writes while the indexes are built
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_user_first_name_id",
+            "user",
+            ["first_name", "id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_user_last_name_id",
+            "user",
+            ["last_name", "id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_user_last_name_id", table_name="user")
+    op.drop_index("ix_user_first_name_id", table_name="user")
@@ -0,0 +1,198 @@
+"""message partitioning
+
+Revision ID: 23f40d4e821a
+Revises: 5b0c7e21d9a4
+Create Date: 2026-10-17 15:20:31.804512
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "23f40d4e821a"
+down_revision: Union[str, None] = "5b0c7e21d9a4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COPY_BATCH_SIZE = 10000
+# the maintenance job creates the next partitions of the same size
+PARTITION_SIZE = 1000000
+PARTITIONS_AHEAD = 2
+
+COLUMNS = (
+    "id, sender_id, recipient_id, text_content, created_at, updated_at, "
+    "min_user_id, max_user_id"
+)
+
+MIRROR_FUNCTION = f"""
+CREATE FUNCTION message_mirror() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM message_partitioned WHERE id = OLD.id;
+        RETURN OLD;
+    END IF;
+
+    INSERT INTO message_partitioned ({COLUMNS})
+    VALUES (
+        NEW.id, NEW.sender_id, NEW.recipient_id, NEW.text_content,
+        NEW.created_at, NEW.updated_at, NEW.min_user_id, NEW.max_user_id
+    )
+    ON CONFLICT (id) DO UPDATE SET
+        text_content = EXCLUDED.text_content,
+        updated_at = EXCLUDED.updated_at;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def create_message_table(name: str, id_default: bool, **kwargs) -> None:
+    op.create_table(
+        name,
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=(
+                sa.text("nextval('message_id_seq'::regclass)")
+                if id_default
+                else None
+            ),
+            nullable=False,
+        ),
+        sa.Column("sender_id", sa.Integer(), nullable=False),
+        sa.Column("recipient_id", sa.Integer(), nullable=False),
+        sa.Column("text_content", sa.Text(), nullable=False),
+        sa.Column("created_at", postgresql.TIMESTAMP(), nullable=False),
+        sa.Column("updated_at", postgresql.TIMESTAMP(), nullable=True),
+        sa.Column("min_user_id", sa.Integer(), nullable=False),
+        sa.Column("max_user_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["recipient_id"],
+            ["user.id"],
+            name="message_recipient_id_fkey",
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["sender_id"],
+            ["user.id"],
+            name="message_sender_id_fkey",
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("id", name=f"{name}_pkey"),
+        **kwargs,
+    )
+    op.create_index(
+        f"ix_{name}_conversation",
+        name,
+        ["min_user_id", "max_user_id", sa.text("id DESC")],
+    )
+
+
+def upgrade() -> None:
+    # the table is partitioned by ID ranges, since all queries of the
+    # history are bounded by IDs
+    create_message_table(
+        "message_partitioned",
+        id_default=True,
+        postgresql_partition_by="RANGE (id)",
+    )
+
+    conn = op.get_bind()
+    last_id = conn.execute(
+        sa.text("SELECT last_value FROM message_id_seq")
+    ).scalar()
+    for number in range(last_id // PARTITION_SIZE + PARTITIONS_AHEAD + 1):
+        op.execute(
+            f"CREATE TABLE message_p{number} "
+            "PARTITION OF message_partitioned "
+            f"FOR VALUES FROM ({number * PARTITION_SIZE}) "
+            f"TO ({(number + 1) * PARTITION_SIZE})"
+        )
+
+    # changes made while the rows are being copied are mirrored
+    op.execute(MIRROR_FUNCTION)
+    op.execute(
+        "CREATE TRIGGER message_mirror "
+        "AFTER INSERT OR UPDATE OR DELETE ON message "
+        "FOR EACH ROW EXECUTE FUNCTION message_mirror()"
+    )
+
+    # every batch is committed separately, so the table is never locked
+    # for the whole copying
+    with op.get_context().autocommit_block():
+        max_id = conn.execute(
+            sa.text("SELECT coalesce(max(id), 0) FROM message")
+        ).scalar()
+
+        for first_id in range(0, max_id, COPY_BATCH_SIZE):
+            # the copied rows are locked until the batch is committed, so
+            # their concurrent changes are mirrored after they are copied
+            conn.execute(
+                sa.text(
+                    f"INSERT INTO message_partitioned ({COLUMNS}) "
+                    f"SELECT {COLUMNS} FROM message "
+                    "WHERE id > :first_id AND id <= :last_id "
+                    "FOR SHARE "
+                    "ON CONFLICT (id) DO NOTHING"
+                ),
+                {
+                    "first_id": first_id,
+                    "last_id": first_id + COPY_BATCH_SIZE,
+                },
+            )
+
+    # the tables are swapped in one short transaction
+    op.execute("LOCK TABLE message IN ACCESS EXCLUSIVE MODE")
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY message_partitioned.id")
+    op.drop_table("message")
+    op.execute("DROP FUNCTION message_mirror()")
+    op.rename_table("message_partitioned", "message")
+    op.execute(
+        "ALTER TABLE message "
+        "RENAME CONSTRAINT message_partitioned_pkey TO message_pkey"
+    )
+    op.execute(
+        "ALTER INDEX ix_message_partitioned_conversation "
+        "RENAME TO ix_message_conversation"
+    )
+
+    # messages of old partitions are moved here by the maintenance job. The
+    # archive is never updated, so its pages are filled completely, and the
+    # texts are compressed in rows longer than 128 bytes instead of 2 kB
+    create_message_table("message_archive", id_default=False)
+    op.execute(
+        "ALTER TABLE message_archive "
+        "SET (fillfactor = 100, toast_tuple_target = 128)"
+    )
+    op.execute(
+        "ALTER TABLE message_archive "
+        "ALTER COLUMN text_content SET STORAGE MAIN"
+    )
+
+
+def downgrade() -> None:
+    create_message_table("message_plain", id_default=True)
+    op.execute(
+        f"INSERT INTO message_plain ({COLUMNS}) "
+        f"SELECT {COLUMNS} FROM message_archive "
+        "UNION ALL "
+        f"SELECT {COLUMNS} FROM message"
+    )
+
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY message_plain.id")
+    op.drop_table("message_archive")
+    op.drop_table("message")
+    op.rename_table("message_plain", "message")
+    op.execute(
+        "ALTER TABLE message "
+        "RENAME CONSTRAINT message_plain_pkey TO message_pkey"
+    )
+    op.execute(
+        "ALTER INDEX ix_message_plain_conversation "
+        "RENAME TO ix_message_conversation"
+    )
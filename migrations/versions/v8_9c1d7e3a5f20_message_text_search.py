@@ -0,0 +1,79 @@
+"""message text search
+
+Revision ID: 9c1d7e3a5f20
+Revises: 23f40d4e821a
+Create Date: 2026-10-17 18:05:47.219360
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9c1d7e3a5f20"
+down_revision: Union[str, None] = "23f40d4e821a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_VECTOR = "to_tsvector('simple', text_content)"
+# every search is limited to the conversations of a user, so the user IDs are
+# indexed together with the text, and only the matches of the user are read
+USER_ID_COLUMNS = ("min_user_id", "max_user_id")
+
+
+def upgrade() -> None:
+    # GIN operator classes for integers
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+
+    conn = op.get_bind()
+
+    # an index of a partitioned table can't be built concurrently, so it is
+    # created invalid on the parent table only, and becomes valid when the
+    # indexes of all partitions are attached to it
+    for column in USER_ID_COLUMNS:
+        op.execute(
+            f"CREATE INDEX ix_message_{column}_text_search ON ONLY message "
+            f"USING gin ({column}, {SEARCH_VECTOR})"
+        )
+    partitions = conn.execute(
+        sa.text(
+            "SELECT partition.relname FROM pg_inherits "
+            "JOIN pg_class AS partition "
+            "ON partition.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = 'message'::regclass"
+        )
+    ).scalars().all()
+
+    # the tables are not locked for writes while the indexes are built
+    with op.get_context().autocommit_block():
+        for column in USER_ID_COLUMNS:
+            for partition in partitions:
+                op.execute(
+                    "CREATE INDEX CONCURRENTLY "
+                    f"ix_{partition}_{column}_text_search ON {partition} "
+                    f"USING gin ({column}, {SEARCH_VECTOR})"
+                )
+                op.execute(
+                    f"ALTER INDEX ix_message_{column}_text_search "
+                    f"ATTACH PARTITION ix_{partition}_{column}_text_search"
+                )
+
+            op.execute(
+                "CREATE INDEX CONCURRENTLY "
+                f"ix_message_archive_{column}_text_search "
+                f"ON message_archive USING gin ({column}, {SEARCH_VECTOR})"
+            )
+
+
+def downgrade() -> None:
+    # the extension is kept, since it may be used by other indexes
+    for column in reversed(USER_ID_COLUMNS):
+        op.drop_index(
+            f"ix_message_archive_{column}_text_search",
+            table_name="message_archive",
+        )
+        # the indexes of the partitions are dropped with the parent one
+        op.drop_index(f"ix_message_{column}_text_search", table_name="message")
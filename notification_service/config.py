@@ -11,6 +11,13 @@ class Settings(BaseSettings):
 
     NOTIFICATION_SERVICE_PORT: int
 
+    # notifications are sent within the limits of the Telegram Bot API (messages per second)
+    NOTIFICATIONS_GLOBAL_RATE: float = 30
+    NOTIFICATIONS_PER_CHAT_RATE: float = 1
+    NOTIFICATIONS_BACKLOG_SIZE: int = 10000
+    NOTIFICATIONS_SENDERS_COUNT: int = 10
+    NOTIFICATIONS_MAX_RETRIES: int = 3
+
     # model_config = SettingsConfigDict(env_file=".env")
     model_config = SettingsConfigDict(env_file=".env-non-dev")
 
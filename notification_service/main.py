@@ -4,29 +4,68 @@ import uvicorn
 from aiogram import Bot, Dispatcher
 from aiogram.filters import CommandStart
 from aiogram.types import Message
-from fastapi import FastAPI, HTTPException
+from fastapi import Body, FastAPI, HTTPException, Query
 
 from config import settings
+from schemas import Notification
+from send_queue import SendQueue
 
 
 bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
 dp = Dispatcher()
 
+send_queue = SendQueue(
+    bot,
+    global_rate=settings.NOTIFICATIONS_GLOBAL_RATE,
+    per_chat_rate=settings.NOTIFICATIONS_PER_CHAT_RATE,
+    max_backlog=settings.NOTIFICATIONS_BACKLOG_SIZE,
+    senders_count=settings.NOTIFICATIONS_SENDERS_COUNT,
+    max_retries=settings.NOTIFICATIONS_MAX_RETRIES
+)
+
 app = FastAPI()
 
 
 @app.post("/notify/")
-async def notify(telegram_id: int, sender_full_name: str):
-    try:
-        await bot.send_message(telegram_id, f"User {sender_full_name} has sent you a message!")
+async def notify(
+        telegram_id: int,
+        sender_full_names: list[str] = Query(..., min_length=1),
+        senders_count: int = Query(1, ge=1),
+        messages_count: int = Query(1, ge=1)
+):
+    notification = Notification(
+        telegram_id=telegram_id,
+        sender_full_names=sender_full_names,
+        senders_count=senders_count,
+        messages_count=messages_count
+    )
+
+    return await notify_batch([notification])
+
+
+@app.post("/notify/batch")
+async def notify_batch(notifications: list[Notification] = Body(..., max_length=1000)):
+    """
+    Notifications are queued and sent within the limits of the Telegram Bot API. If the backlog has no space
+    for all of them, none is accepted.
+    """
+
+    if not send_queue.put_many(notifications):
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "status": "error",
+                "details": "The notifications backlog is full."
+            },
+            headers={"Retry-After": str(send_queue.retry_after)}
+        )
 
-        return {"status": "success"}
+    return {"status": "success"}
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail={
-            "status": "success",
-            "details": str(e)
-        })
+
+@app.get("/metrics")
+async def get_metrics():
+    return send_queue.get_metrics()
 
 
 @dp.message(CommandStart())
@@ -70,6 +109,8 @@ async def start_api():
 
 
 async def main():
+    await send_queue.start()
+
     bot_task = asyncio.create_task(start_bot())
     api_task = asyncio.create_task(start_api())
 
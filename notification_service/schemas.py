@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+
+
+class Notification(BaseModel):
+    telegram_id: int
+    sender_full_names: list[str] = Field(..., min_length=1)
+    senders_count: int = Field(1, ge=1)
+    messages_count: int = Field(1, ge=1)
+
+    @property
+    def text(self) -> str:
+        if self.messages_count == 1:
+            return f"User {self.sender_full_names[0]} has sent you a message!"
+
+        senders = ", ".join(self.sender_full_names)
+        if self.senders_count > len(self.sender_full_names):
+            senders += f" and {self.senders_count - len(self.sender_full_names)} more"
+
+        return f"{self.messages_count} new messages from {senders}"
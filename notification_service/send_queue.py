@@ -0,0 +1,190 @@
+import asyncio
+import time
+import traceback
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from config import logger
+from schemas import Notification
+
+
+# buckets of idle chats are removed when there are more of them
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    @property
+    def is_full(self) -> bool:
+        self._refill()
+
+        return self._tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        """
+        Takes a token at once and waits until it becomes available, so concurrent callers are served in order.
+        """
+
+        self._refill()
+        self._tokens -= 1
+
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+
+class SendQueue:
+    """
+    Notifications are buffered in a bounded queue and sent by several concurrent senders. Every message takes
+    a token from the bucket of its chat and from the global bucket, so the bot stays within the limits of the
+    Telegram Bot API. If Telegram still answers with "retry_after", all senders wait for the specified time.
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            global_rate: float,
+            per_chat_rate: float,
+            max_backlog: int,
+            senders_count: int,
+            max_retries: int
+    ):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.senders_count = senders_count
+        self.max_retries = max_retries
+
+        self._queue: asyncio.Queue[Notification] = asyncio.Queue(maxsize=max_backlog)
+        self._senders: list[asyncio.Task] = []
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+
+        self._counters = {"accepted": 0, "rejected": 0, "sent": 0, "retried": 0, "failed": 0}
+
+    @property
+    def free_space(self) -> int:
+        return self._queue.maxsize - self._queue.qsize()
+
+    @property
+    def retry_after(self) -> int:
+        """
+        Approximate number of seconds until the current backlog is sent.
+        """
+
+        return int(self._queue.qsize() / self._global_bucket.rate) + 1
+
+    def put_many(self, notifications: list[Notification]) -> bool:
+        """
+        The notifications are accepted only if all of them fit into the backlog.
+        """
+
+        if self.free_space < len(notifications):
+            self._counters["rejected"] += len(notifications)
+
+            return False
+
+        for notification in notifications:
+            self._queue.put_nowait(notification)
+        self._counters["accepted"] += len(notifications)
+
+        return True
+
+    def get_metrics(self) -> dict[str, int]:
+        return {
+            **self._counters,
+            "backlog": self._queue.qsize(),
+            "backlog_limit": self._queue.maxsize,
+            "paused_for": max(0, int(self._paused_until - time.monotonic()))
+        }
+
+    async def start(self) -> None:
+        self._senders = [asyncio.create_task(self._send_forever()) for _ in range(self.senders_count)]
+
+    async def stop(self) -> None:
+        for sender in self._senders:
+            sender.cancel()
+
+    async def _send_forever(self) -> None:
+        while True:
+            notification = await self._queue.get()
+            try:
+                await self._send(notification)
+
+            except Exception as e:
+                traceback_message = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+                logger.error(f"Failed to send a notification. More details:\n{traceback_message}")
+
+                self._counters["failed"] += 1
+
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, notification: Notification) -> None:
+        failed_attempts = 0
+        while True:
+            await self._get_chat_bucket(notification.telegram_id).acquire()
+            await self._wait_for_flood_control()
+            await self._global_bucket.acquire()
+
+            try:
+                await self.bot.send_message(notification.telegram_id, notification.text)
+
+            except TelegramRetryAfter as e:
+                # waiting for the flood control is not a failed attempt, the notification is sent after the pause
+                logger.warning(f"Flood control exceeded, sending is paused for {e.retry_after} seconds.")
+
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                self._counters["retried"] += 1
+
+            except (TelegramNetworkError, TelegramServerError) as e:
+                failed_attempts += 1
+                logger.warning(f"Failed to send a notification (attempt {failed_attempts}): {e}")
+
+                if failed_attempts > self.max_retries:
+                    break
+
+                self._counters["retried"] += 1
+                await asyncio.sleep(2 ** (failed_attempts - 1))
+
+            except TelegramAPIError as e:
+                # e.g. the user has blocked the bot, so retrying is useless
+                logger.warning(f"Notification to chat {notification.telegram_id} is rejected: {e}")
+
+                self._counters["failed"] += 1
+
+                return
+
+            else:
+                self._counters["sent"] += 1
+
+                return
+
+        logger.error(f"Notification to chat {notification.telegram_id} is dropped after {failed_attempts} attempts.")
+        self._counters["failed"] += 1
+
+    async def _wait_for_flood_control(self) -> None:
+        while (delay := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    def _get_chat_bucket(self, telegram_id: int) -> TokenBucket:
+        if telegram_id not in self._chat_buckets:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._chat_buckets = {
+                    chat_id: bucket for chat_id, bucket in self._chat_buckets.items() if not bucket.is_full
+                }
+
+            self._chat_buckets[telegram_id] = TokenBucket(self.per_chat_rate)
+
+        return self._chat_buckets[telegram_id]